@@ -0,0 +1,439 @@
+from sys import argv
+import os
+import random
+import time
+import tracemalloc
+import formats.c2s as c2s
+import formats.convert as convert
+import formats.sus as sus
+from formats.incremental import IncrementalParser
+import formats.snapshot as snapshot
+from formats.diagnostics import NullSink
+
+
+def help():
+    print("Usage: benchmark.py [command]")
+    print(
+        "parse [input...]\n\tMeasures sus parser throughput on the given files and on synthetic charts"
+    )
+    print(
+        "channels\n\tMeasures how parse time grows with the number of notes on one long note channel"
+    )
+    print(
+        "sessions [count]\n\tParses <count> synthetic charts in one reused context, reporting traced memory"
+    )
+    print(
+        "memory [measures]\n\tMeasures memory per parsed and converted note on a synthetic chart"
+    )
+    print(
+        "convert [measures]\n\tMeasures sus_to_c2s throughput on a synthetic chart"
+    )
+    print(
+        "c2sparse [measures]\n\tCompares the old if-chain parser, line-by-line and bulk c2s parsing on a synthetic chart"
+    )
+    print(
+        "c2swrite [measures]\n\tCompares building c2s output as a string with streaming it to a file"
+    )
+    print(
+        "snapshot [measures]\n\tCompares loading a snapshot with parsing the text of a synthetic chart"
+    )
+    print(
+        "incremental [measures]\n\tTimes one-line edits with IncrementalParser against a full parse"
+    )
+    return 1
+
+
+def synthetic_sus(measures, seed=0):
+    """
+    Generate the lines of a dense synthetic .sus chart.
+
+    Args:
+        measures: Number of measures to fill
+        seed: Random seed, so runs are comparable
+
+    Returns:
+        List of lines, as read from a file
+    """
+    rng = random.Random(seed)
+    lines = [
+        '#TITLE "Synthetic"\n',
+        '#REQUEST "ticks_per_beat 480"\n',
+        "#00002: 4\n",
+        "#BPM01: 190\n",
+        "#00008: 01\n",
+    ]
+
+    def payload(division, kinds):
+        return "".join(
+            "%s%s" % (rng.choice(kinds), rng.randint(1, 8))
+            if rng.random() < 0.5
+            else "00"
+            for _ in range(division)
+        )
+
+    for measure in range(measures):
+        prefix = "#%05d" % measure if measure > 999 else "#%03d" % measure
+        for lane in rng.sample(range(16), 4):
+            lines.append("%s1%x: %s\n" % (prefix, lane, payload(16, "1234")))
+        lines.append("%s5%x: %s\n" % (prefix, rng.randrange(16), payload(8, "123456")))
+        # One slide per measure per channel, so channels get reused heavily
+        for channel in range(2):
+            lane = rng.randrange(12)
+            lines.append("%s3%x%s: 13000000\n" % (prefix, lane, channel))
+            lines.append("%s3%x%s: 00003300\n" % (prefix, lane + 2, channel))
+            lines.append("%s3%x%s: 00000023\n" % (prefix, lane, channel))
+    return lines
+
+
+def time_parse(lines, repeat=3):
+    """
+    Parse the given lines with a fresh context, returning the best time in seconds.
+    """
+    best = None
+    for _ in range(repeat):
+        context = sus.SusContext(NullSink())
+        start = time.perf_counter()
+        sus.parse(lines, context)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def bench_parse(filenames):
+    charts = []
+    for filename in filenames:
+        f = open(filename, "r")
+        charts.append((os.path.basename(filename), f.readlines()))
+        f.close()
+    for measures in (100, 500, 1000):
+        charts.append(("synthetic-%s" % measures, synthetic_sus(measures)))
+
+    for name, lines in charts:
+        elapsed = time_parse(lines)
+        print(
+            "%-20s %8d lines %10.0f lines/s" % (name, len(lines), len(lines) / elapsed)
+        )
+    return 0
+
+
+def bench_channels():
+    for notes in (1500, 3000, 6000, 12000, 24000):
+        lines = []
+        for measure in range(notes // 3):
+            lines.append("#%05d3aa: 130000330023\n" % measure)
+        elapsed = time_parse(lines)
+        print(
+            "%8d notes on one channel %8.3f s %6.2f us/note"
+            % (notes, elapsed, elapsed * 1e6 / notes)
+        )
+    return 0
+
+
+def bench_sessions(count):
+    lines = synthetic_sus(20)
+    context = sus.SusContext(NullSink())
+    tracemalloc.start()
+    for i in range(1, count + 1):
+        context.reset()
+        sus.parse(lines, context)
+        if i % (count // 5 or 1) == 0:
+            (current, peak) = tracemalloc.get_traced_memory()
+            print(
+                "%6d charts %8.1f KiB traced %8.1f KiB peak"
+                % (i, current / 1024, peak / 1024)
+            )
+    tracemalloc.stop()
+    context.close()
+    return 0
+
+
+def traced_size(build):
+    """
+    Call build(), returning its result and how many bytes it left allocated.
+    """
+    tracemalloc.start()
+    result = build()
+    (current, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (result, current)
+
+
+def bench_memory(measures):
+    lines = synthetic_sus(measures)
+    (sus_data, sus_bytes) = traced_size(
+        lambda: sus.parse(lines, sus.SusContext(NullSink()))
+    )
+    sus_notes = sum(isinstance(o, (sus.ShortNote, sus.LongNote)) for o in sus_data)
+    print(
+        "sus  %8d notes %10.1f KiB %6.1f bytes/note"
+        % (sus_notes, sus_bytes / 1024, sus_bytes / sus_notes)
+    )
+
+    ((definitions, notes), c2s_bytes) = traced_size(
+        lambda: convert.sus_to_c2s(sus_data, diagnostics=NullSink())
+    )
+    print(
+        "c2s  %8d notes %10.1f KiB %6.1f bytes/note"
+        % (len(notes), c2s_bytes / 1024, c2s_bytes / len(notes))
+    )
+    return 0
+
+
+def bench_convert(measures):
+    sus_data = sus.parse(synthetic_sus(measures), sus.SusContext(NullSink()))
+    best = None
+    for _ in range(3):
+        start = time.perf_counter()
+        (definitions, notes) = convert.sus_to_c2s(sus_data, diagnostics=NullSink())
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    print(
+        "%-20s %8d notes %10.0f notes/s" % ("sus_to_c2s", len(notes), len(notes) / best)
+    )
+    return 0
+
+
+def legacy_c2s_from_string(c2s_string: str):
+    """
+    Copy of c2s.from_string() from before the handler table, as a baseline.
+    """
+    line = c2s_string.split()
+    obj = None
+    if len(line) > 0:
+        if line[0] == "BPM":
+            obj = c2s.BpmSetting()
+            obj.bpm = float(line[3])
+        if line[0] == "MET":
+            obj = c2s.MeterSetting()
+            obj.signature = (int(line[3]), int(line[4]))
+        if line[0] == "SFL":
+            obj = c2s.SpeedSetting()
+            obj.length = int(line[3])
+            obj.speed = float(line[4])
+        if line[0] == "TAP":
+            obj = c2s.TapNote()
+        if line[0] == "MNE":
+            obj = c2s.MineNote()
+        if line[0] == "CHR":
+            obj = c2s.ChargeNote()
+        if line[0] == "FLK":
+            obj = c2s.FlickNote()
+        if line[0] == "AHD":
+            obj = c2s.AirHold()
+            obj.length = int(line[6])
+        if line[0] == "HLD":
+            obj = c2s.HoldNote()
+            obj.length = int(line[5])
+        if line[0] == "SLD" or line[0] == "SLC":
+            obj = c2s.SlideNote()
+            obj.length = int(line[5])
+            obj.end_lane = int(line[6])
+            obj.end_width = int(line[7])
+            obj.is_curve = line[0] == "SLC"
+
+        if line[0] == "AUL":
+            obj = c2s.AirNote()
+            obj.direction = -1
+            obj.isUp = True
+        if line[0] == "AUR":
+            obj = c2s.AirNote()
+            obj.direction = 1
+            obj.isUp = True
+        if line[0] == "AIR":
+            obj = c2s.AirNote()
+            obj.direction = 0
+            obj.isUp = True
+        if line[0] == "ADL":
+            obj = c2s.AirNote()
+            obj.direction = -1
+            obj.isUp = False
+        if line[0] == "ADR":
+            obj = c2s.AirNote()
+            obj.direction = 1
+            obj.isUp = False
+        if line[0] == "ADW":
+            obj = c2s.AirNote()
+            obj.direction = 0
+            obj.isUp = False
+
+        if isinstance(obj, c2s.C2sObject):
+            obj.measure = int(line[1])
+            obj.tick = int(line[2])
+        if isinstance(obj, c2s.C2sNote):
+            obj.lane = int(line[3])
+            obj.width = int(line[4])
+
+    if obj == None:
+        return []
+
+    return [obj]
+
+
+def bench_c2s_parse(measures):
+    sus_data = sus.parse(synthetic_sus(measures), sus.SusContext(NullSink()))
+    (definitions, notes) = convert.sus_to_c2s(sus_data, diagnostics=NullSink())
+    lines = c2s.create_file(definitions, notes).splitlines(True)
+    parsers = (
+        ("if-chain (old)", lambda lines: [
+            obj for line in lines for obj in legacy_c2s_from_string(line)
+        ]),
+        ("iter_parse", lambda lines: list(c2s.iter_parse(lines))),
+        ("parse_c2s", c2s.parse_c2s),
+    )
+    results = []
+    for (name, parser) in parsers:
+        best = None
+        for _ in range(3):
+            start = time.perf_counter()
+            objects = parser(lines)
+            elapsed = time.perf_counter() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        print("%-20s %8d lines %10.0f lines/s" % (name, len(lines), len(lines) / best))
+        results.append(list(map(str, objects)))
+
+    if any(result != results[0] for result in results[1:]):
+        print("Outputs differ!")
+        return 1
+    return 0
+
+
+def bench_c2s_write(measures, filename="benchmark.c2s"):
+    sus_data = sus.parse(synthetic_sus(measures), sus.SusContext(NullSink()))
+    (definitions, notes) = convert.sus_to_c2s(sus_data, diagnostics=NullSink())
+
+    def build():
+        f = open(filename, "w")
+        f.write(c2s.create_file(definitions, notes))
+        f.close()
+
+    def stream():
+        f = open(filename, "w")
+        c2s.write_c2s(f, definitions, notes)
+        f.close()
+
+    for name, write in (("create_file", build), ("write_c2s", stream)):
+        start = time.perf_counter()
+        write()
+        elapsed = time.perf_counter() - start
+        tracemalloc.start()
+        write()
+        (current, peak) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(
+            "%-20s %8d notes %10.0f notes/s %10.1f KiB peak"
+            % (name, len(notes), len(notes) / elapsed, peak / 1024)
+        )
+    os.remove(filename)
+    return 0
+
+
+def bench_incremental(measures, edits=200):
+    lines = synthetic_sus(measures)
+    full = time_parse(lines)
+    parser = IncrementalParser(lines, NullSink())
+    rng = random.Random(0)
+    times = []
+    for _ in range(edits):
+        # Move the notes of a line to another lane, as an editor would
+        i = rng.randrange(5, len(lines))
+        line = parser.lines[i]
+        line = line[:5] + "%x" % rng.randrange(12) + line[6:]
+        start = time.perf_counter()
+        parser.edit(i, i + 1, [line])
+        times.append(time.perf_counter() - start)
+    times.sort()
+    print("%8d lines, full parse %10.2f ms" % (len(lines), full * 1000))
+    print(
+        "%8d edits, median %10.3f ms, slowest %.3f ms"
+        % (edits, times[len(times) // 2] * 1000, times[-1] * 1000)
+    )
+
+    # A long note line with a valid pair before an invalid one, as an editor sends
+    # while typing. It must leave the channel as it was once it's fixed again
+    i = next(i for i, line in enumerate(parser.lines) if line.startswith("#0003"))
+    line = parser.lines[i]
+    parser.edit(i, i + 1, [line[: line.index(":")] + ": 1360\n"])
+    parser.edit(i, i + 1, [line])
+
+    expected = sus.parse(parser.lines, sus.SusContext(NullSink()))
+    got = parser.objects()
+    fields = ("measure", "tick", "lane", "width", "note_type", "channel")
+    if [[getattr(o, f, None) for f in fields] for o in got] != [
+        [getattr(o, f, None) for f in fields] for o in expected
+    ]:
+        print("Results differ from a full parse!")
+        return 1
+    return 0
+
+
+def bench_snapshot(measures, filename="benchmark.snap"):
+    lines = synthetic_sus(measures)
+    sus_data = sus.parse(lines, sus.SusContext(NullSink()))
+    snapshot.save_sus(filename, sus_data)
+    parse_time = time_parse(lines)
+
+    (best_columns, best) = (None, None)
+    for _ in range(3):
+        start = time.perf_counter()
+        with snapshot.Snapshot(filename) as chart:
+            columns = chart.columns()
+        elapsed = time.perf_counter() - start
+        if best_columns is None or elapsed < best_columns:
+            best_columns = elapsed
+
+        start = time.perf_counter()
+        loaded = snapshot.load(filename)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    print("parse    %8d objects %10.2f ms" % (len(sus_data), parse_time * 1000))
+    print("snapshot %8d notes   %10.2f ms (columns)" % (len(columns), best_columns * 1000))
+    print("snapshot %8d objects %10.2f ms" % (len(loaded), best * 1000))
+    print("snapshot %8d bytes" % os.path.getsize(filename))
+    os.remove(filename)
+
+    expected = convert.sus_to_c2s(sus_data, diagnostics=NullSink())
+    got = convert.sus_to_c2s(loaded, diagnostics=NullSink())
+    if list(map(str, expected[0] + expected[1])) != list(map(str, got[0] + got[1])):
+        print("Loaded chart converts differently!")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    argc = len(argv)
+
+    if argc == 1:
+        exit(help())
+
+    if argv[1] == "parse":
+        exit(bench_parse(argv[2:]))
+
+    if argv[1] == "channels":
+        exit(bench_channels())
+
+    if argv[1] == "convert":
+        exit(bench_convert(int(argv[2]) if argc > 2 else 2000))
+
+    if argv[1] == "memory":
+        exit(bench_memory(int(argv[2]) if argc > 2 else 2000))
+
+    if argv[1] == "c2sparse":
+        exit(bench_c2s_parse(int(argv[2]) if argc > 2 else 2000))
+
+    if argv[1] == "c2swrite":
+        exit(bench_c2s_write(int(argv[2]) if argc > 2 else 2000))
+
+    if argv[1] == "snapshot":
+        exit(bench_snapshot(int(argv[2]) if argc > 2 else 1000))
+
+    if argv[1] == "incremental":
+        exit(bench_incremental(int(argv[2]) if argc > 2 else 1000))
+
+    if argv[1] == "sessions":
+        exit(bench_sessions(int(argv[2]) if argc > 2 else 1000))
+
+    exit(help())
@@ -1,23 +1,38 @@
 from abc import ABC, abstractmethod
 from enum import Enum, auto
+from operator import attrgetter
+import io
+from .tempo import TempoMap
+from .timeline import Timeline
 
 C2S_TICKS_PER_MEASURE = 384
 
 
 class C2sObject(ABC):
-    measure = 0
-    tick = 0
+    __slots__ = ("measure", "tick")
+
+    def __init__(self, measure=0, tick=0):
+        self.measure = measure
+        self.tick = tick
 
 
 class BpmSetting(C2sObject):
-    bpm = 0.0
+    __slots__ = ("bpm",)
+
+    def __init__(self, measure=0, tick=0, bpm=0.0):
+        super().__init__(measure, tick)
+        self.bpm = bpm
 
     def __str__(self):
         return "BPM\t%s\t%s\t%s" % (self.measure, self.tick, self.bpm)
 
 
 class MeterSetting(C2sObject):
-    signature = (0, 0)
+    __slots__ = ("signature",)
+
+    def __init__(self, measure=0, tick=0, signature=(0, 0)):
+        super().__init__(measure, tick)
+        self.signature = signature
 
     def __str__(self):
         return "MET\t%s\t%s\t%s\t%s" % (
@@ -29,11 +44,15 @@ class MeterSetting(C2sObject):
 
 
 class SpeedSetting(C2sObject):
-    length = 0
-    speed = 1.0
+    __slots__ = ("length", "speed")
+
+    def __init__(self, measure=0, tick=0, length=0, speed=1.0):
+        super().__init__(measure, tick)
+        self.length = length
+        self.speed = speed
 
     def __str__(self):
-        return "SFL\t%s\t%s\t%s\t%s" % (
+        return "SFL\t%s\t%s\t%s\t%.6f" % (
             self.measure,
             self.tick,
             self.length,
@@ -42,21 +61,31 @@ class SpeedSetting(C2sObject):
 
 
 class C2sNote(C2sObject):
-    lane = 0
-    width = 0
+    __slots__ = ("lane", "width")
+
+    def __init__(self, measure=0, tick=0, lane=0, width=0):
+        super().__init__(measure, tick)
+        self.lane = lane
+        self.width = width
 
 
 class TapNote(C2sNote):
+    __slots__ = ()
+
     def __str__(self):
         return "TAP\t%s\t%s\t%s\t%s" % (self.measure, self.tick, self.lane, self.width)
 
 
 class MineNote(C2sNote):
+    __slots__ = ()
+
     def __str__(self):
         return "MNE\t%s\t%s\t%s\t%s" % (self.measure, self.tick, self.lane, self.width)
 
 
 class ChargeNote(C2sNote):
+    __slots__ = ()
+
     def __str__(self):
         # Seems to always be "UP"
         return "CHR\t%s\t%s\t%s\t%s\tUP" % (
@@ -70,6 +99,8 @@ class ChargeNote(C2sNote):
 
 
 class FlickNote(C2sNote):
+    __slots__ = ()
+
     def __str__(self):
         # Seems to always be "Left"
         return "FLK\t%s\t%s\t%s\t%s\tL" % (
@@ -83,7 +114,11 @@ class FlickNote(C2sNote):
 
 
 class AirHold(C2sNote):
-    length = 0
+    __slots__ = ("length",)
+
+    def __init__(self, measure=0, tick=0, lane=0, width=0, length=0):
+        super().__init__(measure, tick, lane, width)
+        self.length = length
 
     def __str__(self):
         return "AHD\t%s\t%s\t%s\t%s\tTAP\t%s" % (
@@ -96,7 +131,11 @@ class AirHold(C2sNote):
 
 
 class HoldNote(C2sNote):
-    length = 0
+    __slots__ = ("length",)
+
+    def __init__(self, measure=0, tick=0, lane=0, width=0, length=0):
+        super().__init__(measure, tick, lane, width)
+        self.length = length
 
     def __str__(self):
         return "HLD\t%s\t%s\t%s\t%s\t%s" % (
@@ -109,10 +148,24 @@ class HoldNote(C2sNote):
 
 
 class SlideNote(C2sNote):
-    length = 0
-    end_lane = 0
-    end_width = 0
-    is_curve = False
+    __slots__ = ("length", "end_lane", "end_width", "is_curve")
+
+    def __init__(
+        self,
+        measure=0,
+        tick=0,
+        lane=0,
+        width=0,
+        length=0,
+        end_lane=0,
+        end_width=0,
+        is_curve=False,
+    ):
+        super().__init__(measure, tick, lane, width)
+        self.length = length
+        self.end_lane = end_lane
+        self.end_width = end_width
+        self.is_curve = is_curve
 
     def __str__(self):
         if self.is_curve:
@@ -132,9 +185,15 @@ class SlideNote(C2sNote):
 
 
 class AirNote(C2sNote):
-    isUp = True
-    direction = 0
-    linkage = "TAP"  # Apparently doesn't matter
+    __slots__ = ("isUp", "direction", "linkage")
+
+    def __init__(
+        self, measure=0, tick=0, lane=0, width=0, isUp=True, direction=0, linkage="TAP"
+    ):
+        super().__init__(measure, tick, lane, width)
+        self.isUp = isUp
+        self.direction = direction
+        self.linkage = linkage  # Apparently doesn't matter
 
     def __str__(self):
         if self.isUp:
@@ -162,172 +221,515 @@ class AirNote(C2sNote):
         )
 
 
+# Objects are created without running their __init__, since every field is
+# set by the handler anyway
+_new = object.__new__
+
+
+def _parse_bpm(fields):
+    obj = _new(BpmSetting)
+    obj.measure = int(fields[1])
+    obj.tick = int(fields[2])
+    obj.bpm = float(fields[3])
+    return obj
+
+
+def _parse_meter(fields):
+    obj = _new(MeterSetting)
+    obj.measure = int(fields[1])
+    obj.tick = int(fields[2])
+    obj.signature = (int(fields[3]), int(fields[4]))
+    return obj
+
+
+def _parse_speed(fields):
+    obj = _new(SpeedSetting)
+    obj.measure = int(fields[1])
+    obj.tick = int(fields[2])
+    obj.length = int(fields[3])
+    obj.speed = float(fields[4])
+    return obj
+
+
+def _short_note(cls):
+    def parse(fields):
+        obj = _new(cls)
+        obj.measure = int(fields[1])
+        obj.tick = int(fields[2])
+        obj.lane = int(fields[3])
+        obj.width = int(fields[4])
+        return obj
+
+    return parse
+
+
+def _parse_air_hold(fields):
+    obj = _new(AirHold)
+    obj.measure = int(fields[1])
+    obj.tick = int(fields[2])
+    obj.lane = int(fields[3])
+    obj.width = int(fields[4])
+    obj.length = int(fields[6])
+    return obj
+
+
+def _parse_hold(fields):
+    obj = _new(HoldNote)
+    obj.measure = int(fields[1])
+    obj.tick = int(fields[2])
+    obj.lane = int(fields[3])
+    obj.width = int(fields[4])
+    obj.length = int(fields[5])
+    return obj
+
+
+def _slide_note(is_curve):
+    def parse(fields):
+        obj = _new(SlideNote)
+        obj.measure = int(fields[1])
+        obj.tick = int(fields[2])
+        obj.lane = int(fields[3])
+        obj.width = int(fields[4])
+        obj.length = int(fields[5])
+        obj.end_lane = int(fields[6])
+        obj.end_width = int(fields[7])
+        obj.is_curve = is_curve
+        return obj
+
+    return parse
+
+
+def _air_note(isUp, direction):
+    def parse(fields):
+        obj = _new(AirNote)
+        obj.measure = int(fields[1])
+        obj.tick = int(fields[2])
+        obj.lane = int(fields[3])
+        obj.width = int(fields[4])
+        obj.isUp = isUp
+        obj.direction = direction
+        obj.linkage = "TAP"
+        return obj
+
+    return parse
+
+
+# Line handlers, keyed on the tag in the first field. Each takes the split
+# fields of a line and returns the object they describe. Tags that aren't in
+# here (header and footer lines) are ignored.
+_HANDLERS = {
+    "BPM": _parse_bpm,
+    "MET": _parse_meter,
+    "SFL": _parse_speed,
+    "TAP": _short_note(TapNote),
+    "MNE": _short_note(MineNote),
+    "CHR": _short_note(ChargeNote),
+    "FLK": _short_note(FlickNote),
+    "AHD": _parse_air_hold,
+    "HLD": _parse_hold,
+    "SLD": _slide_note(False),
+    "SLC": _slide_note(True),
+    "AUL": _air_note(True, -1),
+    "AUR": _air_note(True, 1),
+    "AIR": _air_note(True, 0),
+    "ADL": _air_note(False, -1),
+    "ADR": _air_note(False, 1),
+    "ADW": _air_note(False, 0),
+}
+
+
+def parse_line(c2s_string: str):
+    """
+    Parse one line of a c2s file.
+
+    Returns:
+        The c2s object on the line, or None if it doesn't hold one
+    """
+    fields = c2s_string.split()
+    if not fields:
+        return None
+    handler = _HANDLERS.get(fields[0])
+    if handler is None:
+        return None
+    return handler(fields)
+
+
 def from_string(c2s_string: str):
-    line = c2s_string.split()
-    obj = None
-    if len(line) > 0:
-        if line[0] == "BPM":
-            obj = BpmSetting()
-            obj.bpm = float(line[3])
-        if line[0] == "MET":
-            obj = MeterSetting()
-            obj.signature = (int(line[3]), int(line[4]))
-        if line[0] == "SFL":
-            obj = SpeedSetting()
-            obj.length = int(line[3])
-            obj.speed = float(line[4])
-        if line[0] == "TAP":
-            obj = TapNote()
-        if line[0] == "MNE":
-            obj = MineNote()
-        if line[0] == "CHR":
-            obj = ChargeNote()
-        if line[0] == "FLK":
-            obj = FlickNote()
-        if line[0] == "AHD":
-            obj = AirHold()
-            obj.length = int(line[6])
-        if line[0] == "HLD":
-            obj = HoldNote()
-            obj.length = int(line[5])
-        if line[0] == "SLD" or line[0] == "SLC":
-            obj = SlideNote()
-            obj.length = int(line[5])
-            obj.end_lane = int(line[6])
-            obj.end_width = int(line[7])
-            obj.is_curve = line[0] == "SLC"
-
-        if line[0] == "AUL":
-            obj = AirNote()
-            obj.direction = -1
-            obj.isUp = True
-        if line[0] == "AUR":
-            obj = AirNote()
-            obj.direction = 1
-            obj.isUp = True
-        if line[0] == "AIR":
-            obj = AirNote()
-            obj.direction = 0
-            obj.isUp = True
-        if line[0] == "ADL":
-            obj = AirNote()
-            obj.direction = -1
-            obj.isUp = False
-        if line[0] == "ADR":
-            obj = AirNote()
-            obj.direction = 1
-            obj.isUp = False
-        if line[0] == "ADW":
-            obj = AirNote()
-            obj.direction = 0
-            obj.isUp = False
-
-        if isinstance(obj, C2sObject):
-            obj.measure = int(line[1])
-            obj.tick = int(line[2])
-        if isinstance(obj, C2sNote):
-            obj.lane = int(line[3])
-            obj.width = int(line[4])
-
-    if obj == None:
+    obj = parse_line(c2s_string)
+    if obj is None:
         return []
-
     return [obj]
 
 
-def create_file(definitions, notes):
-    sample_header = """VERSION	1.07.00	1.07.00
-MUSIC	0
-SEQUENCEID	0
-DIFFICULT	00
-LEVEL	0.0
-CREATOR	Meme
-BPM_DEF	132.000	132.000	132.000	132.000
-MET_DEF	4	4
-RESOLUTION	384
-CLK_DEF	384
-PROGJUDGE_BPM	240.000
-PROGJUDGE_AER	  0.999
-TUTORIAL	0
-"""
-    sample_footer = """T_REC_TAP	999
-T_REC_CHR	999
-T_REC_FLK	999
-T_REC_MNE	999
-T_REC_HLD	999
-T_REC_SLD	999
-T_REC_AIR	999
-T_REC_AHD	999
-T_REC_ALL	999
-T_NOTE_TAP	999
-T_NOTE_CHR	999
-T_NOTE_FLK	999
-T_NOTE_MNE	0
-T_NOTE_HLD	999
-T_NOTE_SLD	999
-T_NOTE_AIR	999
-T_NOTE_AHD	999
-T_NOTE_ALL	999
-T_NUM_TAP	999
-T_NUM_CHR	999
-T_NUM_FLK	999
-T_NUM_MNE	0
-T_NUM_HLD	999
-T_NUM_SLD	999
-T_NUM_AIR	999
-T_NUM_AHD	999
-T_NUM_AAC	999
-T_CHRTYPE_UP	999
-T_CHRTYPE_DW	0
-T_CHRTYPE_CE	0
-T_LEN_HLD	999999
-T_LEN_SLD	999999
-T_LEN_AHD	999999
-T_LEN_ALL	999999
-T_JUDGE_TAP	999
-T_JUDGE_HLD	999
-T_JUDGE_SLD	999
-T_JUDGE_AIR	999
-T_JUDGE_FLK	999
-T_JUDGE_ALL	9999
-T_FIRST_MSEC	100
-T_FIRST_RES	100
-T_FINAL_MSEC	999999
-T_FINAL_RES	999999
-T_PROG_00	46
-T_PROG_05	52
-T_PROG_10	57
-T_PROG_15	43
-T_PROG_20	58
-T_PROG_25	56
-T_PROG_30	55
-T_PROG_35	60
-T_PROG_40	88
-T_PROG_45	51
-T_PROG_50	43
-T_PROG_55	43
-T_PROG_60	44
-T_PROG_65	53
-T_PROG_70	64
-T_PROG_75	65
-T_PROG_80	51
-T_PROG_85	84
-T_PROG_90	52
-T_PROG_95	81
-"""
-    if any(filter(lambda d: isinstance(d, MeterSetting), definitions)) == 0:
-        setting = MeterSetting()
-        setting.signature = (4, 4)
-        setting.measure = 0
-        setting.tick = 0
-        definitions.append(setting)
-
-    return (
-        sample_header
-        + "\n"
-        + "\n".join(map(str, definitions))
-        + "\n\n"
-        + "\n".join(map(str, notes))
-        + "\n\n"
-        + sample_footer
+def parse_c2s(stream):
+    """
+    Parse every line of a c2s file into a single list of c2s objects.
+
+    Args:
+        stream: Iterable of lines, such as an open file
+    """
+    handlers = _HANDLERS
+    objects = []
+    append = objects.append
+    for line in stream:
+        fields = line.split()
+        if fields:
+            handler = handlers.get(fields[0])
+            if handler is not None:
+                append(handler(fields))
+    return objects
+
+
+def build_timeline(c2s_objects, ticks_per_measure=C2S_TICKS_PER_MEASURE):
+    """
+    Build the Timeline of a chart from the MeterSetting objects among its c2s objects.
+    """
+    return Timeline(
+        ticks_per_measure,
+        [
+            (obj.measure, obj.signature[0])
+            for obj in c2s_objects
+            if isinstance(obj, MeterSetting)
+        ],
+    )
+
+
+def build_tempo_map(c2s_objects, ticks_per_measure=C2S_TICKS_PER_MEASURE):
+    """
+    Build the TempoMap of a chart from its MeterSetting and BpmSetting objects.
+    """
+    c2s_objects = list(c2s_objects)
+    timeline = build_timeline(c2s_objects, ticks_per_measure)
+    return TempoMap(
+        timeline,
+        [
+            (timeline.absolute(obj.measure, obj.tick), obj.bpm)
+            for obj in c2s_objects
+            if isinstance(obj, BpmSetting)
+        ],
+    )
+
+
+def iter_parse(lines):
+    """
+    Parse the lines of a c2s file, yielding c2s objects as each line is parsed.
+
+    Args:
+        lines: Iterable of lines, such as an open file
+    """
+    for line in lines:
+        obj = parse_line(line)
+        if obj is not None:
+            yield obj
+
+
+# Tags notes are counted under in the footer, in the order they are written
+STAT_TAGS = ("TAP", "CHR", "FLK", "MNE", "HLD", "SLD", "AIR", "AHD")
+PROGRESS_BUCKETS = 20
+
+_STAT_TAGS = {
+    TapNote: "TAP",
+    ChargeNote: "CHR",
+    FlickNote: "FLK",
+    MineNote: "MNE",
+    HoldNote: "HLD",
+    SlideNote: "SLD",
+    AirNote: "AIR",
+    AirHold: "AHD",
+}
+
+
+class ChartStats:
+    """
+    Header and footer statistics of a chart, gathered in a single pass over its notes.
+
+    Positions are in resolution ticks (measure * ticks_per_measure + tick), and
+    times in milliseconds from the start of the chart, following the BPM settings.
+    Mines are records but not notes, and a slide that starts where another one
+    ends is the same note as that one.
+    """
+
+    def __init__(self, definitions, notes, ticks_per_measure=C2S_TICKS_PER_MEASURE):
+        """
+        Args:
+            definitions: BPM, meter and speed settings of the chart
+            notes: Notes of the chart, in time order
+            ticks_per_measure: Resolution of the chart
+        """
+        definitions = list(definitions)
+        self.ticks_per_measure = ticks_per_measure
+        self.tempo = build_tempo_map(definitions, ticks_per_measure)
+        self.records = dict.fromkeys(STAT_TAGS, 0)
+        self.notes = dict.fromkeys(STAT_TAGS, 0)
+        # Milliseconds each kind of sustain note is active
+        self.lengths = {"HLD": 0.0, "SLD": 0.0, "AHD": 0.0}
+        self.first_res = None
+        self.final_res = 0
+        self.signature = next(
+            (obj.signature for obj in definitions if isinstance(obj, MeterSetting)),
+            (4, 4),
+        )
+
+        # Start times of the notes, for the progress buckets
+        self._times = []
+        # Ends of the slides seen so far, as (res, lane, width)
+        slide_ends = set()
+
+        for note in notes:
+            tag = _STAT_TAGS.get(type(note))
+            if tag is None:
+                continue
+            res = note.measure * ticks_per_measure + note.tick
+            end = res
+            self.records[tag] += 1
+
+            if tag == "SLD":
+                is_note = (res, note.lane, note.width) not in slide_ends
+                slide_ends.add((res + note.length, note.end_lane, note.end_width))
+            else:
+                is_note = tag != "MNE"
+            if is_note:
+                self.notes[tag] += 1
+                self._times.append(self.msec(res))
+            if tag in self.lengths:
+                end = res + note.length
+                self.lengths[tag] += self.msec(end) - self.msec(res)
+
+            if self.first_res is None or res < self.first_res:
+                self.first_res = res
+            if end > self.final_res:
+                self.final_res = end
+
+        if self.first_res is None:
+            self.first_res = 0
+
+    def msec(self, res):
+        """
+        Time of a position in resolution ticks, in milliseconds.
+        """
+        return self.tempo.seconds(*divmod(res, self.ticks_per_measure)) * 1000
+
+    def bpms(self):
+        """
+        BPM_DEF values: the starting tempo, the tempo held longest besides it
+        (the starting one again if there is none), that tempo again, and the
+        starting tempo again.
+        """
+        tempo = self.tempo
+        final = tempo.timeline.absolute(*divmod(self.final_res, self.ticks_per_measure))
+        # The last tempo is held until the end of the chart
+        ends = tempo.ticks[1:] + [max(final, tempo.ticks[-1])]
+        bpms = [tempo.bpm_at(tick) for tick in tempo.ticks]
+        held = {}
+        for i, bpm in enumerate(bpms):
+            seconds = (ends[i] - tempo.ticks[i]) * tempo.tick_seconds[i]
+            held[bpm] = held.get(bpm, 0) + seconds
+        start = bpms[0]
+        del held[start]
+        alternative = max(held, key=held.get) if held else start
+        return (start, alternative, alternative, start)
+
+    def progress(self):
+        """
+        Notes in each 5% of the chart, from its start to the end of its final note.
+        """
+        buckets = [0] * PROGRESS_BUCKETS
+        final = self.msec(self.final_res)
+        if final <= 0:
+            buckets[0] = sum(self.notes.values())
+            return buckets
+        for msec in self._times:
+            bucket = int(msec * PROGRESS_BUCKETS / final)
+            buckets[min(bucket, PROGRESS_BUCKETS - 1)] += 1
+        return buckets
+
+    def header(self):
+        """
+        Header lines that depend on the chart.
+        """
+        return [
+            "BPM_DEF\t%.3f\t%.3f\t%.3f\t%.3f" % self.bpms(),
+            "MET_DEF\t%s\t%s" % self.signature,
+            "RESOLUTION\t%s" % self.ticks_per_measure,
+            "CLK_DEF\t%s" % self.ticks_per_measure,
+        ]
+
+    def footer(self):
+        """
+        Footer lines, in the order they are written.
+        """
+        records = self.records
+        notes = self.notes
+        output = []
+        for tag in STAT_TAGS:
+            output.append("T_REC_%s\t%s" % (tag, records[tag]))
+        output.append("T_REC_ALL\t%s" % sum(records.values()))
+        for tag in STAT_TAGS:
+            output.append("T_NOTE_%s\t%s" % (tag, notes[tag]))
+        output.append("T_NOTE_ALL\t%s" % sum(notes.values()))
+        for tag in STAT_TAGS:
+            output.append("T_NUM_%s\t%s" % (tag, notes[tag]))
+        # The meaning of T_NUM_AAC isn't known
+        output.append("T_NUM_AAC\t0")
+        # Charge notes are always written as "UP"
+        output.append("T_CHRTYPE_UP\t%s" % notes["CHR"])
+        output.append("T_CHRTYPE_DW\t0")
+        output.append("T_CHRTYPE_CE\t0")
+        lengths = {tag: round(msec) for tag, msec in self.lengths.items()}
+        for tag, msec in lengths.items():
+            output.append("T_LEN_%s\t%d" % (tag, msec))
+        output.append("T_LEN_ALL\t%d" % sum(lengths.values()))
+        # Judgement counts depend on the game's combo rules, which aren't known here
+        output.append("T_JUDGE_TAP\t999")
+        output.append("T_JUDGE_HLD\t999")
+        output.append("T_JUDGE_SLD\t999")
+        output.append("T_JUDGE_AIR\t999")
+        output.append("T_JUDGE_FLK\t999")
+        output.append("T_JUDGE_ALL\t9999")
+        output.append("T_FIRST_MSEC\t%d" % round(self.msec(self.first_res)))
+        output.append("T_FIRST_RES\t%s" % self.first_res)
+        output.append("T_FINAL_MSEC\t%d" % round(self.msec(self.final_res)))
+        output.append("T_FINAL_RES\t%s" % self.final_res)
+        for i, count in enumerate(self.progress()):
+            output.append("T_PROG_%02d\t%s" % (i * 100 // PROGRESS_BUCKETS, count))
+        return output
+
+
+def _format_meter(obj):
+    return "MET\t%s\t%s\t%s\t%s\n" % (
+        obj.measure,
+        obj.tick,
+        obj.signature[0],
+        obj.signature[1],
+    )
+
+
+def _format_slide(obj):
+    template = _SLC_TEMPLATE if obj.is_curve else _SLD_TEMPLATE
+    return template % (
+        obj.measure,
+        obj.tick,
+        obj.lane,
+        obj.width,
+        obj.length,
+        obj.end_lane,
+        obj.end_width,
     )
+
+
+def _format_air(obj):
+    direction = (obj.direction > 0) - (obj.direction < 0)
+    return _AIR_TEMPLATES[(bool(obj.isUp), direction)] % (
+        obj.measure,
+        obj.tick,
+        obj.lane,
+        obj.width,
+        obj.linkage,
+    )
+
+
+def _formatter(template, *fields):
+    get = attrgetter(*fields)
+    return lambda obj: template % get(obj)
+
+
+_SLD_TEMPLATE = "SLD\t%s\t%s\t%s\t%s\t%s\t%s\t%s\n"
+_SLC_TEMPLATE = "SLC\t%s\t%s\t%s\t%s\t%s\t%s\t%s\n"
+# Air note templates, keyed on (isUp, sign of direction)
+_AIR_TEMPLATES = {
+    (True, -1): "AUL\t%s\t%s\t%s\t%s\t%s\n",
+    (True, 0): "AIR\t%s\t%s\t%s\t%s\t%s\n",
+    (True, 1): "AUR\t%s\t%s\t%s\t%s\t%s\n",
+    (False, -1): "ADL\t%s\t%s\t%s\t%s\t%s\n",
+    (False, 0): "ADW\t%s\t%s\t%s\t%s\t%s\n",
+    (False, 1): "ADR\t%s\t%s\t%s\t%s\t%s\n",
+}
+
+# Line writers of each class, with the same output as str() plus a newline.
+# The templates are prepared once instead of on every __str__ call.
+_FORMATTERS = {
+    BpmSetting: _formatter("BPM\t%s\t%s\t%s\n", "measure", "tick", "bpm"),
+    MeterSetting: _format_meter,
+    SpeedSetting: _formatter(
+        "SFL\t%s\t%s\t%s\t%.6f\n", "measure", "tick", "length", "speed"
+    ),
+    TapNote: _formatter("TAP\t%s\t%s\t%s\t%s\n", "measure", "tick", "lane", "width"),
+    MineNote: _formatter("MNE\t%s\t%s\t%s\t%s\n", "measure", "tick", "lane", "width"),
+    ChargeNote: _formatter(
+        "CHR\t%s\t%s\t%s\t%s\tUP\n", "measure", "tick", "lane", "width"
+    ),
+    FlickNote: _formatter(
+        "FLK\t%s\t%s\t%s\t%s\tL\n", "measure", "tick", "lane", "width"
+    ),
+    AirHold: _formatter(
+        "AHD\t%s\t%s\t%s\t%s\tTAP\t%s\n", "measure", "tick", "lane", "width", "length"
+    ),
+    HoldNote: _formatter(
+        "HLD\t%s\t%s\t%s\t%s\t%s\n", "measure", "tick", "lane", "width", "length"
+    ),
+    SlideNote: _format_slide,
+    AirNote: _format_air,
+}
+
+
+def _format(obj):
+    formatter = _FORMATTERS.get(type(obj))
+    if formatter is None:
+        return str(obj) + "\n"
+    return formatter(obj)
+
+
+def write_c2s(fp, definitions, notes):
+    """
+    Write a c2s file to a text stream, one line at a time.
+
+    The lines are written as they are formatted instead of being joined into one
+    string first, which saves the size of the output text. Memory use still grows
+    with the chart: the header needs the statistics of every note before the first
+    note line, so the notes are held in a list and ChartStats keeps the time of
+    each one. A meter setting of 4/4 is written if the chart doesn't have any.
+
+    Args:
+        fp: Text stream to write to, such as an open file or sys.stdout
+        definitions: BPM, meter and speed settings of the chart
+        notes: Notes of the chart, in time order. Anything but a list or tuple,
+            such as an iterator, is read into a list first
+    """
+    definitions = list(definitions)
+    if not isinstance(notes, (list, tuple)):
+        notes = list(notes)
+    if not any(isinstance(d, MeterSetting) for d in definitions):
+        definitions.append(MeterSetting(0, 0, (4, 4)))
+
+    stats = ChartStats(definitions, notes)
+    header = [
+        "VERSION\t1.07.00\t1.07.00",
+        "MUSIC\t0",
+        "SEQUENCEID\t0",
+        "DIFFICULT\t00",
+        "LEVEL\t0.0",
+        "CREATOR\tMeme",
+        *stats.header(),
+        "PROGJUDGE_BPM\t240.000",
+        "PROGJUDGE_AER\t  0.999",
+        "TUTORIAL\t0",
+    ]
+    fp.write("\n".join(header) + "\n")
+    # Sections are separated by an empty line
+    fp.write("\n")
+    fp.writelines(map(_format, definitions))
+    fp.write("\n")
+    fp.writelines(map(_format, notes))
+    if not notes:
+        fp.write("\n")
+    fp.write("\n")
+    fp.write("\n".join(stats.footer()) + "\n")
+
+
+def create_file(definitions, notes):
+    """
+    Render a c2s file to a string. See write_c2s().
+    """
+    output = io.StringIO()
+    write_c2s(output, definitions, notes)
+    return output.getvalue()
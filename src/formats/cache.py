@@ -0,0 +1,155 @@
+import hashlib
+import os
+import tempfile
+
+DEFAULT_MAX_SIZE = 512 * 1024 * 1024
+
+_versions = {}
+
+
+def converter_version(sources=()):
+    """
+    Hash of the source of the formats package and of the given extra source files,
+    such as the command line module that drives the converters, so that changing
+    any parser, converter or command invalidates everything cached before.
+    """
+    sources = tuple(sources)
+    version = _versions.get(sources)
+    if version is None:
+        digest = hashlib.sha256()
+        directory = os.path.dirname(os.path.abspath(__file__))
+        paths = [
+            os.path.join(directory, name)
+            for name in sorted(os.listdir(directory))
+            if name.endswith(".py")
+        ]
+        for path in paths + list(sources):
+            f = open(path, "rb")
+            digest.update(os.path.basename(path).encode() + b"\0" + f.read())
+            f.close()
+        version = _versions[sources] = digest.hexdigest()
+    return version
+
+
+class ConversionCache:
+    """
+    Converted files kept on disk, addressed by a hash of what produced them.
+
+    Every entry is a file named after its key, so workers in other processes
+    can read and write the same cache. Reading an entry updates its mtime, and
+    evict() deletes the least recently used entries once the cache is too big.
+    """
+
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE, sources=()):
+        """
+        Args:
+            directory: Directory to keep the entries in, created when needed
+            max_size: Size in bytes that evict() shrinks the cache to
+            sources: Source files outside the formats package whose changes
+                invalidate the entries, see converter_version()
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.sources = tuple(sources)
+
+    def key(self, data, command, *options):
+        """
+        Key of the output of a command on some input bytes, with the given options.
+        """
+        digest = hashlib.sha256()
+        digest.update(converter_version(self.sources).encode())
+        for part in (command,) + options:
+            digest.update(b"\0" + str(part).encode())
+        digest.update(b"\0" + data)
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        """
+        Cached output for a key, or None if there isn't any.
+        """
+        path = self.path(key)
+        try:
+            f = open(path, "r", encoding="utf-8", newline="")
+        except FileNotFoundError:
+            return None
+        output = f.read()
+        f.close()
+        os.utime(path)
+        return output
+
+    def put(self, key, output):
+        """
+        Store the output for a key.
+        """
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first, so readers never see half an entry
+        (fd, temporary) = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".")
+        f = open(fd, "w", encoding="utf-8", newline="")
+        f.write(output)
+        f.close()
+        os.replace(temporary, path)
+
+    def entries(self):
+        """
+        (path, size, last used time) of every entry, least recently used first.
+        """
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for prefix in os.listdir(self.directory):
+            subdirectory = os.path.join(self.directory, prefix)
+            if not os.path.isdir(subdirectory):
+                continue
+            for name in os.listdir(subdirectory):
+                if name.startswith("."):
+                    continue  # Still being written
+                path = os.path.join(subdirectory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((path, stat.st_size, stat.st_mtime))
+        entries.sort(key=lambda entry: entry[2])
+        return entries
+
+    def size(self):
+        """
+        Total size of the entries, in bytes.
+        """
+        return sum(size for (_, size, _) in self.entries())
+
+    def evict(self, max_size=None):
+        """
+        Delete the least recently used entries until the cache fits in max_size bytes.
+
+        Returns:
+            Number of entries deleted
+        """
+        if max_size is None:
+            max_size = self.max_size
+        entries = self.entries()
+        total = sum(size for (_, size, _) in entries)
+        deleted = 0
+        for path, size, _ in entries:
+            if total <= max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            deleted += 1
+        return deleted
+
+    def clear(self):
+        """
+        Delete every entry.
+
+        Returns:
+            Number of entries deleted
+        """
+        return self.evict(0)
@@ -0,0 +1,322 @@
+from array import array
+from . import c2s
+from . import sus
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+FORMAT_SUS = "sus"
+FORMAT_C2S = "c2s"
+
+# Note kinds of sus charts, matching the note type digit of a sus data line
+SUS_TAP = 1
+SUS_HOLD = 2
+SUS_SLIDE = 3
+SUS_AIR_HOLD = 4
+SUS_AIR = 5
+
+# Note kinds of c2s charts, one per note class
+C2S_NOTE_CLASSES = (
+    c2s.TapNote,
+    c2s.ChargeNote,
+    c2s.FlickNote,
+    c2s.MineNote,
+    c2s.HoldNote,
+    c2s.SlideNote,
+    c2s.AirHold,
+    c2s.AirNote,
+)
+(
+    C2S_TAP,
+    C2S_CHARGE,
+    C2S_FLICK,
+    C2S_MINE,
+    C2S_HOLD,
+    C2S_SLIDE,
+    C2S_AIR_HOLD,
+    C2S_AIR,
+) = range(1, len(C2S_NOTE_CLASSES) + 1)
+
+_C2S_KINDS = {cls: kind for kind, cls in enumerate(C2S_NOTE_CLASSES, 1)}
+
+# Enum members by value, which is quicker than calling the enum
+_SUS_TAP_TYPES = {t.value: t for t in sus.TapNoteType}
+_SUS_AIR_TYPES = {t.value: t for t in sus.AirNoteType}
+_SUS_LONG_KINDS = {k.value: k for k in sus.LongNoteKind}
+_SUS_LONG_TYPES = {t.value: t for t in sus.LongNoteType}
+
+# Typecodes of the columns. Ticks are absolute, so they get 64 bits.
+COLUMNS = {
+    "tick": "q",
+    "lane": "b",
+    "width": "b",
+    "kind": "b",
+    "type": "b",
+    "channel": "i",
+    "length": "q",
+    "end_lane": "b",
+    "end_width": "b",
+}
+
+_NUMPY_DTYPES = {"q": "int64", "i": "int32", "b": "int8"}
+
+
+def _c2s_air_type(note):
+    # 0-2 are up (straight, right, left), 3-5 the same going down
+    return (0 if note.isUp else 3) + (0, 1, 2)[note.direction]
+
+
+class ChartColumns:
+    """
+    Notes of a chart stored as parallel typed arrays, one entry per note.
+
+    Every note has an absolute tick (see Timeline, kept in `timeline`), lane,
+    width, kind and type. What kind and type mean depends on the format the
+    notes came from: for sus they are the note type digit and the note type
+    enum value, for c2s the C2S_* kind and the variant of the note (curve for
+    slides, direction for air notes). Long note lengths and slide ends are
+    only filled in for c2s.
+
+    Objects that aren't notes (BPM and bar length changes, definitions...) are
+    kept as they are in `definitions`.
+    """
+
+    def __init__(self, format, timeline):
+        self.format = format
+        self.timeline = timeline
+        self.definitions = []
+        # Channel names, indexed by the channel column (-1 is no channel)
+        self.channels = []
+        # (speed, attribute) of sus notes, indexed by the extra column
+        self.extras = [(None, None)]
+        self.extra = array("i")
+        for name, typecode in COLUMNS.items():
+            setattr(self, name, array(typecode))
+
+    def __len__(self):
+        return len(self.tick)
+
+    @classmethod
+    def from_sus(cls, sus_objects, ticks_per_measure=sus.SUS_TICKS_PER_MEASURE):
+        """
+        Build columns from parsed SUS objects, in the order they are given.
+        """
+        sus_objects = list(sus_objects)
+        chart = cls(FORMAT_SUS, sus.build_timeline(sus_objects, ticks_per_measure))
+        absolute = chart.timeline.absolute
+        channel_ids = {}
+        extra_ids = {(None, None): 0}
+
+        for obj in sus_objects:
+            if isinstance(obj, sus.ShortNote):
+                if isinstance(obj.note_type, sus.AirNoteType):
+                    kind = SUS_AIR
+                else:
+                    kind = SUS_TAP
+                channel = -1
+            elif isinstance(obj, sus.LongNote):
+                kind = obj.note_kind.value
+                channel = channel_ids.get(obj.channel)
+                if channel is None:
+                    channel = channel_ids[obj.channel] = len(chart.channels)
+                    chart.channels.append(obj.channel)
+            else:
+                chart.definitions.append(obj)
+                continue
+
+            extra_key = (obj.speed, obj.attribute)
+            extra = extra_ids.get(extra_key)
+            if extra is None:
+                extra = extra_ids[extra_key] = len(chart.extras)
+                chart.extras.append(extra_key)
+
+            chart.tick.append(absolute(obj.measure, obj.tick))
+            chart.lane.append(obj.lane)
+            chart.width.append(obj.width)
+            chart.kind.append(kind)
+            chart.type.append(obj.note_type.value)
+            chart.channel.append(channel)
+            chart.length.append(0)
+            chart.end_lane.append(0)
+            chart.end_width.append(0)
+            chart.extra.append(extra)
+
+        return chart
+
+    @classmethod
+    def from_c2s(cls, c2s_objects, ticks_per_measure=c2s.C2S_TICKS_PER_MEASURE):
+        """
+        Build columns from parsed c2s objects, in the order they are given.
+        """
+        c2s_objects = list(c2s_objects)
+        chart = cls(FORMAT_C2S, c2s.build_timeline(c2s_objects, ticks_per_measure))
+        absolute = chart.timeline.absolute
+
+        for obj in c2s_objects:
+            kind = _C2S_KINDS.get(type(obj))
+            if kind is None:
+                chart.definitions.append(obj)
+                continue
+
+            note_type = 0
+            length = 0
+            end_lane = 0
+            end_width = 0
+            if kind == C2S_AIR:
+                note_type = _c2s_air_type(obj)
+            elif kind == C2S_SLIDE:
+                note_type = 1 if obj.is_curve else 0
+                end_lane = obj.end_lane
+                end_width = obj.end_width
+            if kind == C2S_HOLD or kind == C2S_SLIDE or kind == C2S_AIR_HOLD:
+                length = obj.length
+
+            chart.tick.append(absolute(obj.measure, obj.tick))
+            chart.lane.append(obj.lane)
+            chart.width.append(obj.width)
+            chart.kind.append(kind)
+            chart.type.append(note_type)
+            chart.channel.append(-1)
+            chart.length.append(length)
+            chart.end_lane.append(end_lane)
+            chart.end_width.append(end_width)
+            chart.extra.append(0)
+
+        return chart
+
+    def column(self, name):
+        """
+        Get a column by name, as a NumPy array sharing its memory if NumPy is
+        installed, or as the underlying array otherwise.
+        """
+        values = getattr(self, name)
+        if numpy is None:
+            return values
+        return numpy.frombuffer(values, dtype=_NUMPY_DTYPES[values.typecode])
+
+    def take(self, indices):
+        """
+        Make new columns holding the notes at the given indices, in that order.
+        """
+        chart = ChartColumns(self.format, self.timeline)
+        chart.definitions = self.definitions
+        chart.channels = self.channels
+        chart.extras = self.extras
+        for name in list(COLUMNS) + ["extra"]:
+            values = getattr(self, name)
+            setattr(
+                chart, name, array(values.typecode, [values[i] for i in indices])
+            )
+        return chart
+
+    def argsort(self):
+        """
+        Indices that put the notes in time order. Notes on the same tick keep their order.
+        """
+        if numpy is not None:
+            return self.column("tick").argsort(kind="stable").tolist()
+        tick = self.tick
+        return sorted(range(len(tick)), key=tick.__getitem__)
+
+    def sorted(self):
+        """
+        Make new columns with the notes in time order.
+        """
+        return self.take(self.argsort())
+
+    def where(self, **values):
+        """
+        Indices of the notes whose columns equal all the given values, e.g. where(kind=SUS_TAP).
+        """
+        if numpy is not None:
+            mask = numpy.ones(len(self), dtype=bool)
+            for name, value in values.items():
+                mask &= self.column(name) == value
+            return numpy.flatnonzero(mask).tolist()
+        indices = range(len(self))
+        for name, value in values.items():
+            column = getattr(self, name)
+            indices = [i for i in indices if column[i] == value]
+        return list(indices)
+
+    def count_by(self, name):
+        """
+        Count the notes by the value of a column, as a {value: count} dict.
+        """
+        if numpy is not None:
+            (values, counts) = numpy.unique(self.column(name), return_counts=True)
+            return dict(zip(values.tolist(), counts.tolist()))
+        counts = {}
+        for value in getattr(self, name):
+            counts[value] = counts.get(value, 0) + 1
+        return dict(sorted(counts.items()))
+
+    def to_objects(self):
+        """
+        Convert back to the object model: the definitions followed by one object per note.
+
+        Long notes of sus charts are linked into chains again by channel, in time order.
+        """
+        if self.format == FORMAT_SUS:
+            return self.definitions + self._sus_notes()
+        return self.definitions + self._c2s_notes()
+
+    def _sus_notes(self):
+        notes = []
+        channels = [[] for _ in self.channels]
+        (measures, ticks) = self.timeline.position_array(self.column("tick"))
+
+        for i, kind in enumerate(self.kind):
+            if kind == SUS_TAP or kind == SUS_AIR:
+                note_types = _SUS_AIR_TYPES if kind == SUS_AIR else _SUS_TAP_TYPES
+                obj = sus.ShortNote(
+                    measures[i],
+                    ticks[i],
+                    self.lane[i],
+                    self.width[i],
+                    note_types[self.type[i]],
+                )
+            else:
+                channel = self.channel[i]
+                obj = sus.LongNote(
+                    measures[i],
+                    ticks[i],
+                    self.lane[i],
+                    self.width[i],
+                    _SUS_LONG_KINDS[kind],
+                    _SUS_LONG_TYPES[self.type[i]],
+                    self.channels[channel],
+                )
+                channels[channel].append(obj)
+            (obj.speed, obj.attribute) = self.extras[self.extra[i]]
+            notes.append(obj)
+
+        for channel in channels:
+            self.timeline.sort(channel)
+            sus.link_chains(channel)
+
+        return notes
+
+    def _c2s_notes(self):
+        notes = []
+        (measures, ticks) = self.timeline.position_array(self.column("tick"))
+
+        for i, kind in enumerate(self.kind):
+            obj = C2S_NOTE_CLASSES[kind - 1](
+                measures[i], ticks[i], self.lane[i], self.width[i]
+            )
+            if kind == C2S_AIR:
+                note_type = self.type[i]
+                obj.isUp = note_type < 3
+                obj.direction = (0, 1, -1)[note_type % 3]
+            elif kind == C2S_SLIDE:
+                obj.is_curve = self.type[i] == 1
+                obj.end_lane = self.end_lane[i]
+                obj.end_width = self.end_width[i]
+            if kind == C2S_HOLD or kind == C2S_SLIDE or kind == C2S_AIR_HOLD:
+                obj.length = self.length[i]
+            notes.append(obj)
+
+        return notes
@@ -1,13 +1,103 @@
+from heapq import heappop, heappush
+from string import ascii_lowercase, digits
 from . import c2s
 from . import sus
+from .diagnostics import PrintSink
+from .timeline import DEFAULT_BEATS
+
+
+# c2s note class and extra constructor arguments for each sus short note type
+_SHORT_NOTE_CLASSES = {
+    sus.TapNoteType.TAP: (c2s.TapNote, ()),
+    sus.TapNoteType.EXTAP: (c2s.ChargeNote, ()),
+    sus.TapNoteType.FLICK: (c2s.FlickNote, ()),
+    sus.TapNoteType.HELL: (c2s.MineNote, ()),
+    sus.AirNoteType.UP: (c2s.AirNote, (True, 0)),
+    sus.AirNoteType.UP_LEFT: (c2s.AirNote, (True, -1)),
+    sus.AirNoteType.UP_RIGHT: (c2s.AirNote, (True, 1)),
+    sus.AirNoteType.DOWN: (c2s.AirNote, (False, 0)),
+    sus.AirNoteType.DOWN_LEFT: (c2s.AirNote, (False, -1)),
+    sus.AirNoteType.DOWN_RIGHT: (c2s.AirNote, (False, 1)),
+}
+
+_LONG_NOTE_CLASSES = {
+    sus.LongNoteKind.HOLD: c2s.HoldNote,
+    sus.LongNoteKind.SLIDE: c2s.SlideNote,
+    sus.LongNoteKind.AIR_HOLD: c2s.AirHold,
+}
+
+
+def _long_note_end(obj, diagnostics):
+    """
+    Next note in the channel of a long note, where the c2s note made from it ends.
+
+    Returns None when the long note doesn't start a c2s note: END notes are part of
+    the note before them, and channels that end early or switch note kinds are
+    reported to diagnostics.
+    """
+    if obj.note_type == sus.LongNoteType.END:
+        return None
+
+    next_obj = obj.next_note
+    if next_obj is None:
+        diagnostics.warning(
+            "channel-ends-open",
+            "WARNING: Channel ends with a non-END note, assuming intended END",
+        )
+        return None
+    if next_obj.note_kind != obj.note_kind:
+        diagnostics.warning(
+            "channel-kind-switch",
+            "WARNING: Channel switches note kinds (goes from %s:%s to %s:%s on channel %s) - Assuming intended END",
+            obj.note_kind,
+            obj.note_type,
+            next_obj.note_kind,
+            next_obj.note_type,
+            obj.channel,
+        )
+        return None
+    return next_obj
+
+
+def _slide_extra(obj, next_obj):
+    """
+    Extra constructor arguments of the c2s note made from a long note.
+    """
+    if obj.note_kind != sus.LongNoteKind.SLIDE:
+        return ()
+    return (
+        next_obj.lane,
+        next_obj.width,
+        obj.note_type == sus.LongNoteType.CONTROL
+        or obj.note_type == sus.LongNoteType.INVISIBLE,
+    )
 
 
 def sus_to_c2s(
     sus_objects,
     sus_ticks_per_measure=sus.SUS_TICKS_PER_MEASURE,
     c2s_ticks_per_measure=c2s.C2S_TICKS_PER_MEASURE,
+    diagnostics=None,
 ):
+    """
+    Convert SUS objects to c2s, one object at a time.
 
+    Args:
+        sus_objects: SUS objects, as a list or as the iterator iter_parse() returns.
+            The input is read to the end before anything is converted, since long
+            note chains are only linked once SusContext.finalize() has run, and the
+            speed settings need a second look at the notes
+        sus_ticks_per_measure: Ticks per measure in SUS format
+        c2s_ticks_per_measure: Ticks per measure in C2S format
+        diagnostics: DiagnosticSink to report problems to
+
+    Returns:
+        (definitions, notes) tuple of c2s object lists
+    """
+    if diagnostics is None:
+        diagnostics = PrintSink()
+
+    sus_objects = list(sus_objects)
     c2s_definitions = []
     c2s_notes = []
 
@@ -21,70 +111,21 @@ def sus_to_c2s(
 
     for obj in sus_objects:
         if isinstance(obj, sus.ShortNote):
-            if obj.note_type == sus.TapNoteType["TAP"]:
-                note = c2s.TapNote()
-            if obj.note_type == sus.TapNoteType["EXTAP"]:
-                note = c2s.ChargeNote()
-            if obj.note_type == sus.TapNoteType["FLICK"]:
-                note = c2s.FlickNote()
-            if obj.note_type == sus.TapNoteType["HELL"]:
-                note = c2s.MineNote()
-            if obj.note_type == sus.AirNoteType["UP"]:
-                note = c2s.AirNote()
-                note.isUp = True
-                note.direction = 0
-            if obj.note_type == sus.AirNoteType["UP_LEFT"]:
-                note = c2s.AirNote()
-                note.isUp = True
-                note.direction = -1
-            if obj.note_type == sus.AirNoteType["UP_RIGHT"]:
-                note = c2s.AirNote()
-                note.isUp = True
-                note.direction = 1
-            if obj.note_type == sus.AirNoteType["DOWN"]:
-                note = c2s.AirNote()
-                note.isUp = False
-                note.direction = 0
-            if obj.note_type == sus.AirNoteType["DOWN_LEFT"]:
-                note = c2s.AirNote()
-                note.isUp = False
-                note.direction = -1
-            if obj.note_type == sus.AirNoteType["DOWN_RIGHT"]:
-                note = c2s.AirNote()
-                note.isUp = False
-                note.direction = 1
-
-            note.lane = obj.lane
-            note.width = obj.width
-            note.measure = obj.measure
-            note.tick = sus_to_c2s_ticks(obj.tick)
-
+            note_class = _SHORT_NOTE_CLASSES.get(obj.note_type)
+            if note_class is None:
+                continue
+            note = note_class[0](
+                obj.measure,
+                sus_to_c2s_ticks(obj.tick),
+                obj.lane,
+                obj.width,
+                *note_class[1],
+            )
             c2s_notes.append(note)
 
         if isinstance(obj, sus.LongNote):
-            if obj.note_type == sus.LongNoteType["END"]:
-                # Ignore end notes, they're handled differently in c2s
-                continue
-
-            next_idx = obj.linked.index(obj) + 1
-            if next_idx == len(obj.linked):
-                print(
-                    "WARNING: Channel ends with a non-END note, assuming intended END"
-                )
-                continue
-
-            next_obj = obj.linked[next_idx]
-            if next_obj.note_kind != obj.note_kind:
-                print(
-                    "WARNING: Channel switches note kinds (goes from %s:%s to %s:%s at index %s) - Assuming intended END"
-                    % (
-                        obj.note_kind,
-                        obj.note_type,
-                        next_obj.note_kind,
-                        next_obj.note_type,
-                        next_idx,
-                    )
-                )
+            next_obj = _long_note_end(obj, diagnostics)
+            if next_obj is None:
                 continue
 
             start_measure = obj.measure
@@ -96,317 +137,304 @@ def sus_to_c2s(
                 end_ticks - start_ticks
             )
 
-            if obj.note_kind == sus.LongNoteKind["SLIDE"]:
-                note = c2s.SlideNote()
-                note.end_lane = next_obj.lane
-                note.end_width = next_obj.width
-                note.is_curve = (
-                    obj.note_type == sus.LongNoteType["CONTROL"]
-                    or obj.note_type == sus.LongNoteType["INVISIBLE"]
-                )
-            elif obj.note_kind == sus.LongNoteKind["HOLD"]:
-                note = c2s.HoldNote()
-            elif obj.note_kind == sus.LongNoteKind["AIR_HOLD"]:
-                note = c2s.AirHold()
-
-            note.measure = start_measure
-            note.tick = start_ticks
-            note.lane = obj.lane
-            note.width = obj.width
-            note.length = diff_ticks
-
+            note = _LONG_NOTE_CLASSES[obj.note_kind](
+                start_measure,
+                start_ticks,
+                obj.lane,
+                obj.width,
+                diff_ticks,
+                *_slide_extra(obj, next_obj),
+            )
             c2s_notes.append(note)
 
-        if isinstance(obj, sus.BpmChange):
-            definition = c2s.BpmSetting()
-            definition.measure = obj.measure
-            definition.tick = 0  # BPM changes typically happen at the start of measures
-            definition.bpm = obj.definition.tempo
-            c2s_definitions.append(definition)
-
-        if isinstance(obj, sus.BarLength):
-            definition = c2s.MeterSetting()
-            definition.measure = obj.measure
-            definition.tick = (
-                0  # Bar length changes typically happen at the start of measures
-            )
-            definition.signature = (int(obj.length), 4)  # Convert to integer tuple
-            c2s_definitions.append(definition)
+        if isinstance(obj, sus.BpmChange) or isinstance(obj, sus.BarLength):
+            c2s_definitions.append(_convert_definition(obj))
 
-    c2s_notes.sort(key=lambda note: note.measure + note.tick / c2s_ticks_per_measure)
+    c2s.build_timeline(c2s_definitions, c2s_ticks_per_measure).sort(c2s_notes)
+    c2s_definitions.extend(
+        _convert_speeds(sus_objects, sus_ticks_per_measure, c2s_ticks_per_measure)
+    )
     return (c2s_definitions, c2s_notes)
 
 
+def _convert_speeds(sus_objects, sus_ticks_per_measure, c2s_ticks_per_measure):
+    """
+    Convert the speed changes of a SUS chart to the fewest SFL settings that cover them.
+
+    c2s scrolls at the default speed wherever there is no SFL, so only intervals
+    at other speeds are written, each lasting until the next change or, for the
+    last one, until the final note.
+    """
+    speeds = sus.build_speed_timeline(sus_objects, sus_ticks_per_measure)
+    if speeds.speeds == [speeds.default_speed]:
+        return []
+
+    timeline = speeds.timeline
+    end = max(
+        (
+            timeline.absolute(obj.measure, obj.tick)
+            for obj in sus_objects
+            if isinstance(obj, (sus.ShortNote, sus.LongNote))
+        ),
+        default=0,
+    )
+
+    def c2s_position(absolute):
+        (measure, tick) = timeline.position(absolute)
+        return (measure, tick * c2s_ticks_per_measure // sus_ticks_per_measure)
+
+    settings = []
+    for start, stop, speed in speeds.intervals(end):
+        if speed == speeds.default_speed:
+            continue
+        (measure, tick) = c2s_position(start)
+        (stop_measure, stop_tick) = c2s_position(stop)
+        length = (stop_measure - measure) * c2s_ticks_per_measure + stop_tick - tick
+        if length > 0:
+            settings.append(c2s.SpeedSetting(measure, tick, length, speed))
+    return settings
+
+
+def _convert_definition(obj):
+    """
+    Convert a SUS BPM or bar length change to its c2s definition, or None otherwise.
+    """
+    if isinstance(obj, sus.BpmChange):
+        definition = c2s.BpmSetting()
+        definition.measure = obj.measure
+        definition.tick = 0  # BPM changes typically happen at the start of measures
+        definition.bpm = obj.definition.tempo
+        return definition
+
+    if isinstance(obj, sus.BarLength):
+        definition = c2s.MeterSetting()
+        definition.measure = obj.measure
+        definition.tick = (
+            0  # Bar length changes typically happen at the start of measures
+        )
+        definition.signature = (int(obj.length), 4)  # Convert to integer tuple
+        return definition
+
+    return None
+
+
+# Long note channels, as single base 36 digits
+CHANNELS = digits + ascii_lowercase
+
+
+def allocate_channels(intervals):
+    """
+    Assign channels to (start, end) intervals, so that intervals on the same
+    channel never overlap or touch, using as few channels as possible.
+
+    Intervals are swept in start order, with a min-heap of the ends of the busy
+    channels. A channel is free again once its interval ended before the next
+    start, and the lowest free channel is reused first.
+
+    Returns:
+        Channel number of each interval, in the order they were given
+    """
+    channels = [0] * len(intervals)
+    busy = []  # (end, channel) of the intervals still running
+    free = []  # Channels that were used and are free again
+    count = 0
+    for i in sorted(range(len(intervals)), key=intervals.__getitem__):
+        (start, end) = intervals[i]
+        while busy and busy[0][0] < start:
+            heappush(free, heappop(busy)[1])
+        if free:
+            channel = heappop(free)
+        else:
+            channel = count
+            count += 1
+        channels[i] = channel
+        heappush(busy, (end, channel))
+    return channels
+
+
+# sus note type of each c2s short note class. Air notes go by direction instead.
+_SUS_TAP_TYPES = {
+    c2s.TapNote: sus.TapNoteType.TAP,
+    c2s.ChargeNote: sus.TapNoteType.EXTAP,
+    c2s.FlickNote: sus.TapNoteType.FLICK,
+    c2s.MineNote: sus.TapNoteType.HELL,
+}
+
+# sus air note type of each (isUp, sign of direction)
+_SUS_AIR_TYPES = {
+    (True, 0): sus.AirNoteType.UP,
+    (True, -1): sus.AirNoteType.UP_LEFT,
+    (True, 1): sus.AirNoteType.UP_RIGHT,
+    (False, 0): sus.AirNoteType.DOWN,
+    (False, -1): sus.AirNoteType.DOWN_LEFT,
+    (False, 1): sus.AirNoteType.DOWN_RIGHT,
+}
+
+_SUS_LONG_KINDS = {
+    c2s.HoldNote: sus.LongNoteKind.HOLD,
+    c2s.AirHold: sus.LongNoteKind.AIR_HOLD,
+    c2s.SlideNote: sus.LongNoteKind.SLIDE,
+}
+
+
 def c2s_to_sus(
     c2s_objects,
     c2s_ticks_per_measure=c2s.C2S_TICKS_PER_MEASURE,
     ticks_per_beat=480,
+    diagnostics=None,
 ):
     """
     Convert a list of C2S objects to a list of SUS objects.
 
+    Objects are converted in time order, each by the handler of its class. Ticks
+    within a measure are in each format's resolution whatever the meter (see
+    Timeline), so they are scaled by the ratio of the resolutions, and meter
+    changes only matter for the order of the objects and the spans of long notes.
+
     Args:
-        c2s_objects: List of C2S objects (definitions and notes)
+        c2s_objects: C2S objects (definitions and notes), as a list or an iterator.
+            A list isn't changed
         c2s_ticks_per_measure: Ticks per measure in C2S format
         ticks_per_beat: Ticks per beat in SUS format
+        diagnostics: DiagnosticSink to report problems to. Long notes that would
+            need more channels than SUS has are reported and left out
 
     Returns:
         List of SUS objects
     """
+    if diagnostics is None:
+        diagnostics = PrintSink()
+
     sus_objects = []
     sus_objects.append(sus.Request(f'"ticks_per_beat {ticks_per_beat}"'))
-
-    bar_lengths = {}
-
-    # Helper function to convert ticks
-    def c2s_to_sus_ticks(c2s_ticks, measure):
-        """Convert C2S ticks to SUS ticks with proper scaling"""
-        # C2S uses 384 ticks per measure
-        # SUS uses (ticks_per_beat * bar_length) ticks per measure
-        # Scale proportionally: sus_ticks = c2s_ticks * (sus_ticks_per_measure / c2s_ticks_per_measure)
-        bar_length = bar_lengths.get(measure, 4)
-        sus_ticks_per_measure = bar_length * ticks_per_beat
-        scaled_ticks = int((c2s_ticks * sus_ticks_per_measure) / c2s_ticks_per_measure)
-        return scaled_ticks
-
-    # Sort by measure and tick for consistent processing
-    c2s_objects.sort(
-        key=lambda obj: getattr(obj, "measure", 0)
-        + getattr(obj, "tick", 0) / c2s_ticks_per_measure
+    sus_ticks_per_measure = ticks_per_beat * DEFAULT_BEATS
+
+    # Sort a copy by time, through the meter timeline of the chart. The copy also
+    # lets the input be an iterator, such as iter_parse() returns
+    c2s_objects = list(c2s_objects)
+    timeline = c2s.build_timeline(c2s_objects, c2s_ticks_per_measure)
+    timeline.sort(c2s_objects)
+
+    def c2s_to_sus_ticks(c2s_ticks):
+        return c2s_ticks * sus_ticks_per_measure // c2s_ticks_per_measure
+
+    def end_position(obj):
+        (measures, tick) = divmod(obj.tick + obj.length, c2s_ticks_per_measure)
+        return (obj.measure + measures, tick)
+
+    # Give each long note a channel of its own while it lasts
+    long_notes = [obj for obj in c2s_objects if type(obj) in _SUS_LONG_KINDS]
+    allocation = allocate_channels(
+        [
+            (timeline.key(obj), timeline.absolute(*end_position(obj)))
+            for obj in long_notes
+        ]
     )
-
-    # Keep track of BPM definitions to avoid duplicates
+    if allocation and max(allocation) >= len(CHANNELS):
+        diagnostics.error(
+            "channel-overflow",
+            "Error: %d long notes overlap, but SUS only has %d channels. "
+            "Skipping %d long notes",
+            max(allocation) + 1,
+            len(CHANNELS),
+            sum(channel >= len(CHANNELS) for channel in allocation),
+        )
+    channels = {
+        id(obj): CHANNELS[channel]
+        for obj, channel in zip(long_notes, allocation)
+        if channel < len(CHANNELS)
+    }
+
+    # BPM definitions by tempo, to avoid duplicates
     bpm_defs = {}
-    channels = {}  # Track channels for long notes
-    channel_counter = 0
 
-    # Process C2S objects
+    def convert_bpm(obj):
+        bpm_key = str(obj.bpm)
+        bpm_def = bpm_defs.get(bpm_key)
+        if bpm_def is None:
+            bpm_def = sus.BpmDefinition(f"{len(bpm_defs) + 1:02d}", obj.bpm)
+            bpm_defs[bpm_key] = bpm_def
+            sus_objects.append(bpm_def)
+        sus_objects.append(sus.BpmChange(obj.measure, bpm_def))
+
+    def convert_meter(obj):
+        # Numerator of the time signature
+        sus_objects.append(sus.BarLength(obj.measure, obj.signature[0]))
+
+    def convert_tap(obj):
+        sus_objects.append(
+            sus.ShortNote(
+                obj.measure,
+                c2s_to_sus_ticks(obj.tick),
+                obj.lane,
+                obj.width,
+                _SUS_TAP_TYPES[type(obj)],
+            )
+        )
+
+    def convert_air(obj):
+        direction = (obj.direction > 0) - (obj.direction < 0)
+        sus_objects.append(
+            sus.ShortNote(
+                obj.measure,
+                c2s_to_sus_ticks(obj.tick),
+                obj.lane,
+                obj.width,
+                _SUS_AIR_TYPES[(bool(obj.isUp), direction)],
+            )
+        )
+
+    def convert_long(obj):
+        # Every c2s long note becomes a START (or a CONTROL for curved slides)
+        # and an END on the channel it was given
+        channel = channels.get(id(obj))
+        if channel is None:
+            # Left out, for lack of a free channel
+            return
+        kind = _SUS_LONG_KINDS[type(obj)]
+        if kind == sus.LongNoteKind.SLIDE:
+            start_type = (
+                sus.LongNoteType.CONTROL if obj.is_curve else sus.LongNoteType.START
+            )
+            (end_lane, end_width) = (obj.end_lane, obj.end_width)
+        else:
+            start_type = sus.LongNoteType.START
+            (end_lane, end_width) = (obj.lane, obj.width)
+        (end_measure, end_tick) = end_position(obj)
+
+        start_note = sus.LongNote(
+            obj.measure,
+            c2s_to_sus_ticks(obj.tick),
+            obj.lane,
+            obj.width,
+            kind,
+            start_type,
+            channel,
+        )
+        end_note = sus.LongNote(
+            end_measure,
+            c2s_to_sus_ticks(end_tick),
+            end_lane,
+            end_width,
+            kind,
+            sus.LongNoteType.END,
+            channel,
+        )
+        sus.link_chains([start_note, end_note])
+        sus_objects.append(start_note)
+        sus_objects.append(end_note)
+
+    handlers = {
+        c2s.BpmSetting: convert_bpm,
+        c2s.MeterSetting: convert_meter,
+        c2s.AirNote: convert_air,
+    }
+    handlers.update(dict.fromkeys(_SUS_TAP_TYPES, convert_tap))
+    handlers.update(dict.fromkeys(_SUS_LONG_KINDS, convert_long))
+
     for obj in c2s_objects:
-        if isinstance(obj, c2s.BpmSetting):
-            # Check if we've already seen this BPM value
-            bpm_key = str(obj.bpm)
-            if bpm_key not in bpm_defs:
-                # Create BPM definition
-                bpm_def = sus.BpmDefinition()
-                bpm_def.identifier = (
-                    f"{len(bpm_defs) + 1:02d}"  # Generate a unique identifier
-                )
-                bpm_def.tempo = obj.bpm
-                bpm_defs[bpm_key] = bpm_def
-                sus_objects.append(bpm_def)
-            else:
-                bpm_def = bpm_defs[bpm_key]
-
-            # Create BPM change
-            bpm_change = sus.BpmChange()
-            bpm_change.measure = obj.measure
-            bpm_change.definition = bpm_def
-
-            sus_objects.append(bpm_change)
-
-        elif isinstance(obj, c2s.MeterSetting):
-            # Create bar length
-            bar_length = sus.BarLength()
-            bar_length.measure = obj.measure
-            bar_length.length = obj.signature[0]  # Numerator of time signature
-            bar_lengths[obj.measure] = obj.signature[0]
-
-            sus_objects.append(bar_length)
-
-        elif isinstance(obj, c2s.TapNote):
-            note = sus.ShortNote()
-            note.measure = obj.measure
-            note.tick = c2s_to_sus_ticks(obj.tick, obj.measure)
-            note.lane = obj.lane
-            note.width = obj.width
-            note.note_type = sus.TapNoteType.TAP
-
-            sus_objects.append(note)
-
-        elif isinstance(obj, c2s.ChargeNote):
-            note = sus.ShortNote()
-            note.measure = obj.measure
-            note.tick = c2s_to_sus_ticks(obj.tick, obj.measure)
-            note.lane = obj.lane
-            note.width = obj.width
-            note.note_type = sus.TapNoteType.EXTAP
-
-            sus_objects.append(note)
-
-        elif isinstance(obj, c2s.FlickNote):
-            note = sus.ShortNote()
-            note.measure = obj.measure
-            note.tick = c2s_to_sus_ticks(obj.tick, obj.measure)
-            note.lane = obj.lane
-            note.width = obj.width
-            note.note_type = sus.TapNoteType.FLICK
-
-            sus_objects.append(note)
-
-        elif isinstance(obj, c2s.MineNote):
-            note = sus.ShortNote()
-            note.measure = obj.measure
-            note.tick = c2s_to_sus_ticks(obj.tick, obj.measure)
-            note.lane = obj.lane
-            note.width = obj.width
-            note.note_type = sus.TapNoteType.HELL
-
-            sus_objects.append(note)
-
-        elif isinstance(obj, c2s.AirNote):
-            note = sus.ShortNote()
-            note.measure = obj.measure
-            note.tick = c2s_to_sus_ticks(obj.tick, obj.measure)
-            note.lane = obj.lane
-            note.width = obj.width
-
-            # Determine air note type based on direction and orientation
-            if obj.isUp:
-                if obj.direction > 0:
-                    note.note_type = sus.AirNoteType.UP_RIGHT
-                elif obj.direction < 0:
-                    note.note_type = sus.AirNoteType.UP_LEFT
-                else:
-                    note.note_type = sus.AirNoteType.UP
-            else:
-                if obj.direction > 0:
-                    note.note_type = sus.AirNoteType.DOWN_RIGHT
-                elif obj.direction < 0:
-                    note.note_type = sus.AirNoteType.DOWN_LEFT
-                else:
-                    note.note_type = sus.AirNoteType.DOWN
-
-            sus_objects.append(note)
-
-        elif isinstance(obj, c2s.HoldNote):
-            # Generate a unique channel for this hold
-            channel_id = f"{obj.measure}_{obj.tick}_{obj.lane}_{obj.width}"
-            if channel_id not in channels:
-                channel = chr(97 + (channel_counter % 26))  # a-z
-                channels[channel_id] = channel
-                channel_counter += 1
-            else:
-                channel = channels[channel_id]
-
-            # Create start note
-            start_note = sus.LongNote()
-            start_note.measure = obj.measure
-            start_note.tick = c2s_to_sus_ticks(obj.tick, obj.measure)
-            start_note.lane = obj.lane
-            start_note.width = obj.width
-            start_note.note_kind = sus.LongNoteKind.HOLD
-            start_note.note_type = sus.LongNoteType.START
-            start_note.channel = channel
-
-            # Calculate end note position
-            end_ticks = obj.tick + obj.length
-            end_measure = obj.measure + (end_ticks // c2s_ticks_per_measure)
-            end_tick = end_ticks % c2s_ticks_per_measure
-
-            # Create end note
-            end_note = sus.LongNote()
-            end_note.measure = end_measure
-            end_note.tick = c2s_to_sus_ticks(end_tick, end_measure)
-            end_note.lane = obj.lane
-            end_note.width = obj.width
-            end_note.note_kind = sus.LongNoteKind.HOLD
-            end_note.note_type = sus.LongNoteType.END
-            end_note.channel = channel
-
-            # Link the notes
-            start_note.linked = [start_note, end_note]
-            end_note.linked = [start_note, end_note]
-
-            sus_objects.append(start_note)
-            sus_objects.append(end_note)
-
-        elif isinstance(obj, c2s.AirHold):
-            # Generate a unique channel for this air hold
-            channel_id = f"{obj.measure}_{obj.tick}_{obj.lane}_{obj.width}_air"
-            if channel_id not in channels:
-                channel = chr(97 + (channel_counter % 26))  # a-z
-                channels[channel_id] = channel
-                channel_counter += 1
-            else:
-                channel = channels[channel_id]
-
-            # Create start note
-            start_note = sus.LongNote()
-            start_note.measure = obj.measure
-            start_note.tick = c2s_to_sus_ticks(obj.tick, obj.measure)
-            start_note.lane = obj.lane
-            start_note.width = obj.width
-            start_note.note_kind = sus.LongNoteKind.AIR_HOLD
-            start_note.note_type = sus.LongNoteType.START
-            start_note.channel = channel
-
-            # Calculate end note position
-            end_ticks = obj.tick + obj.length
-            end_measure = obj.measure + (end_ticks // c2s_ticks_per_measure)
-            end_tick = end_ticks % c2s_ticks_per_measure
-
-            # Create end note
-            end_note = sus.LongNote()
-            end_note.measure = end_measure
-            end_note.tick = c2s_to_sus_ticks(end_tick, end_measure)
-            end_note.lane = obj.lane
-            end_note.width = obj.width
-            end_note.note_kind = sus.LongNoteKind.AIR_HOLD
-            end_note.note_type = sus.LongNoteType.END
-            end_note.channel = channel
-
-            # Link the notes
-            start_note.linked = [start_note, end_note]
-            end_note.linked = [start_note, end_note]
-
-            sus_objects.append(start_note)
-            sus_objects.append(end_note)
-
-        elif isinstance(obj, c2s.SlideNote):
-            # Generate a unique channel for this slide
-            channel_id = f"{obj.measure}_{obj.tick}_{obj.lane}_{obj.width}_slide"
-            if channel_id not in channels:
-                channel = chr(97 + (channel_counter % 26))  # a-z
-                channels[channel_id] = channel
-                channel_counter += 1
-            else:
-                channel = channels[channel_id]
-
-            # Create start note
-            start_note = sus.LongNote()
-            start_note.measure = obj.measure
-            start_note.tick = c2s_to_sus_ticks(obj.tick, obj.measure)
-            start_note.lane = obj.lane
-            start_note.width = obj.width
-            start_note.note_kind = sus.LongNoteKind.SLIDE
-            start_note.channel = channel
-
-            # Set note type based on if it's a curve
-            if obj.is_curve:
-                start_note.note_type = sus.LongNoteType.CONTROL
-            else:
-                start_note.note_type = sus.LongNoteType.START
-
-            # Calculate end note position
-            end_ticks = obj.tick + obj.length
-            end_measure = obj.measure + (end_ticks // c2s_ticks_per_measure)
-            end_tick = end_ticks % c2s_ticks_per_measure
-
-            # Create end note
-            end_note = sus.LongNote()
-            end_note.measure = end_measure
-            end_note.tick = c2s_to_sus_ticks(end_tick, end_measure)
-            end_note.lane = obj.end_lane
-            end_note.width = obj.end_width
-            end_note.note_kind = sus.LongNoteKind.SLIDE
-            end_note.note_type = sus.LongNoteType.END
-            end_note.channel = channel
-
-            # Link the notes
-            start_note.linked = [start_note, end_note]
-            end_note.linked = [start_note, end_note]
-
-            sus_objects.append(start_note)
-            sus_objects.append(end_note)
+        handler = handlers.get(type(obj))
+        if handler is not None:
+            handler(obj)
 
     return sus_objects
@@ -0,0 +1,117 @@
+from collections import Counter
+from enum import IntEnum
+
+
+class Severity(IntEnum):
+    DEBUG = 10
+    INFO = 20
+    WARNING = 30
+    ERROR = 40
+
+
+class Diagnostic:
+    def __init__(self, severity, code, message):
+        self.severity = severity
+        self.code = code
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+    def __repr__(self):
+        return "Diagnostic(%s, %r, %r)" % (self.severity.name, self.code, self.message)
+
+
+class DiagnosticSink:
+    """
+    Receives the messages reported by the parsers and converters.
+
+    Every report is counted by (severity, code). Only reports at or above
+    `level` get their message formatted and passed to emit(), so raising the
+    level turns most reports into a counter increment.
+    """
+
+    def __init__(self, level=Severity.DEBUG):
+        self.level = level
+        self.counts = Counter()
+
+    def report(self, severity, code, message, *args):
+        self.counts[(severity, code)] += 1
+        if severity >= self.level:
+            self.emit(Diagnostic(severity, code, message % args if args else message))
+
+    def debug(self, code, message, *args):
+        self.report(Severity.DEBUG, code, message, *args)
+
+    def info(self, code, message, *args):
+        self.report(Severity.INFO, code, message, *args)
+
+    def warning(self, code, message, *args):
+        self.report(Severity.WARNING, code, message, *args)
+
+    def error(self, code, message, *args):
+        self.report(Severity.ERROR, code, message, *args)
+
+    def emit(self, diagnostic):
+        pass
+
+    def count(self, severity=None, code=None):
+        """
+        Count reports, optionally only those with the given severity and/or code.
+        """
+        return sum(
+            n
+            for (s, c), n in self.counts.items()
+            if (severity is None or s == severity) and (code is None or c == code)
+        )
+
+    def summary(self):
+        """
+        Render the counters as text, one line per (severity, code), most severe first.
+        """
+        keys = sorted(self.counts, key=lambda key: (-key[0], key[1]))
+        return "\n".join(
+            "%-8s %-28s %d" % (severity.name, code, self.counts[(severity, code)])
+            for (severity, code) in keys
+        )
+
+
+class PrintSink(DiagnosticSink):
+    """
+    Prints reports to stdout, as the command line tool always has, or to another
+    text stream such as stderr when stdout holds the output.
+    """
+
+    def __init__(self, level=Severity.DEBUG, file=None):
+        super().__init__(level)
+        self.file = file
+
+    def emit(self, diagnostic):
+        print(diagnostic.message, file=self.file)
+
+
+class CollectingSink(DiagnosticSink):
+    """
+    Keeps reports as Diagnostic objects, for batch jobs that want them as data.
+    """
+
+    def __init__(self, level=Severity.WARNING):
+        super().__init__(level)
+        self.diagnostics = []
+
+    def emit(self, diagnostic):
+        self.diagnostics.append(diagnostic)
+
+
+class NullSink(DiagnosticSink):
+    """
+    Drops everything without counting it.
+    """
+
+    def report(self, severity, code, message, *args):
+        pass
+
+    def debug(self, code, message, *args):
+        pass
+
+    info = warning = error = debug
@@ -0,0 +1,202 @@
+from . import sus
+from .timeline import Timeline
+
+
+def _save_state(context):
+    # Everything a line can read from the context. Definition dicts are never
+    # changed in place once saved, so saving them is only keeping references.
+    return (
+        context.active_speed,
+        context.active_attribute,
+        context.base_measure,
+        context.bpm_definitions,
+        context.attribute_definitions,
+        context.speed_definitions,
+    )
+
+
+def _restore_state(context, state):
+    (
+        context.active_speed,
+        context.active_attribute,
+        context.base_measure,
+        context.bpm_definitions,
+        context.attribute_definitions,
+        context.speed_definitions,
+    ) = state
+
+
+def _is_note_line(objects):
+    return bool(objects) and isinstance(objects[0], (sus.ShortNote, sus.LongNote))
+
+
+class IncrementalParser:
+    """
+    Keeps a SUS chart parsed while its lines are edited.
+
+    The objects parsed from each line are kept along with the context state
+    (active regions, base measure and definitions) the line was parsed in.
+    An edit parses the new lines, then walks the lines after them only while
+    the state they were parsed in has changed: note lines get their speed and
+    attribute patched in place, or are parsed again if the base measure moved,
+    and region and definition lines are parsed again. The walk stops at the
+    first line whose state is the same as before.
+
+    Long note channels touched by an edit are sorted, repaired and split into
+    chains again, the way SusContext.finalize() does for a whole chart.
+
+    Lines that fail to parse are reported to the diagnostics sink as
+    "invalid-line" errors and hold no objects, where a full parse would raise.
+    """
+
+    def __init__(self, lines=(), diagnostics=None):
+        """
+        Args:
+            lines: Initial lines of the chart
+            diagnostics: DiagnosticSink to report problems to
+        """
+        self.context = sus.SusContext(diagnostics)
+        self.lines = []
+        self.results = []  # Objects parsed from each line
+        # Context state before each line, and after the last one
+        self.states = [_save_state(self.context)]
+        self.chains = {}  # Chains of each channel
+        # Note types as parsed, since fix_channel() replaces some with END
+        self._note_types = {}
+        self._dirty = set()
+        self._timeline_changed = True
+        self.edit(0, 0, lines)
+
+    def __len__(self):
+        return len(self.lines)
+
+    def edit(self, start, stop, lines):
+        """
+        Replace lines[start:stop] with new lines, then bring the parse up to date.
+
+        Returns:
+            Number of lines that were parsed again or patched after the new ones
+        """
+        lines = list(lines)
+        context = self.context
+        _restore_state(context, self.states[start])
+
+        for objects in self.results[start:stop]:
+            self._forget(objects)
+
+        results = []
+        states = []
+        for line in lines:
+            states.append(_save_state(context))
+            results.append(self._parse(line))
+        self.lines[start:stop] = lines
+        self.results[start:stop] = results
+        self.states[start:stop] = states
+
+        touched = 0
+        state = _save_state(context)
+        for i in range(start + len(lines), len(self.lines) + 1):
+            if state == self.states[i]:
+                break
+            old_state = self.states[i]
+            self.states[i] = state
+            if i == len(self.lines):
+                break
+            objects = self.results[i]
+            touched += 1
+            if _is_note_line(objects) and old_state[2] == state[2]:
+                # Only the speed or attribute regions changed
+                for obj in objects:
+                    obj.speed = state[0]
+                    obj.attribute = state[1]
+                continue
+            self._forget(objects)
+            self.results[i] = self._parse(self.lines[i])
+            state = _save_state(context)
+
+        self._finalize()
+        return touched
+
+    def objects(self):
+        """
+        SUS objects of the chart, in line order, as parse() would return them.
+        """
+        return [obj for objects in self.results for obj in objects]
+
+    def _parse(self, line):
+        context = self.context
+        header = line[1:4]
+        if header in ("BPM", "ATR", "TIL"):
+            # Copy the definitions before they change, so saved states keep theirs
+            context.bpm_definitions = dict(context.bpm_definitions)
+            context.attribute_definitions = dict(context.attribute_definitions)
+            context.speed_definitions = dict(context.speed_definitions)
+        try:
+            objects = sus.from_string(line, context)
+        except (KeyError, ValueError, IndexError) as e:
+            # Editors send half-typed lines all the time. The handlers fail before
+            # changing the context, so the line is reported and kept empty until
+            # it parses, and the rest of the chart stays up to date.
+            context.diagnostics.error(
+                "invalid-line", "Error: Couldn't parse line (%r)\n%s", e, line.rstrip()
+            )
+            return []
+
+        for obj in objects:
+            if isinstance(obj, sus.LongNote):
+                self._note_types[obj] = obj.note_type
+                self._dirty.add(obj.channel)
+            elif isinstance(obj, sus.BarLength):
+                self._timeline_changed = True
+        return objects
+
+    def _forget(self, objects):
+        for obj in objects:
+            if isinstance(obj, sus.LongNote):
+                del self._note_types[obj]
+                channel = self.context.channels[obj.channel]
+                channel.remove(obj)
+                self._dirty.add(obj.channel)
+            elif isinstance(obj, sus.BarLength):
+                self._timeline_changed = True
+
+    @staticmethod
+    def _has_ties(channel):
+        return any(
+            a.measure == b.measure and a.tick == b.tick
+            for a, b in zip(channel, channel[1:])
+        )
+
+    def _finalize(self):
+        context = self.context
+        if self._timeline_changed:
+            context.bar_lengths = [
+                (obj.measure, obj.length)
+                for objects in self.results
+                for obj in objects
+                if isinstance(obj, sus.BarLength)
+            ]
+            context.timeline = Timeline(context.ticks_per_measure, context.bar_lengths)
+            self._timeline_changed = False
+
+        for key in self._dirty:
+            channel = context.channels.get(key)
+            if not channel:
+                context.channels.pop(key, None)
+                self.chains.pop(key, None)
+                continue
+            for note in channel:
+                note.note_type = self._note_types[note]
+            context.timeline.sort(channel)
+            if self._has_ties(channel):
+                # Notes on the same tick stay in line order, as in a full parse
+                channel[:] = [
+                    obj
+                    for objects in self.results
+                    for obj in objects
+                    if isinstance(obj, sus.LongNote) and obj.channel == key
+                ]
+                context.timeline.sort(channel)
+            context.fix_channel(key, channel)
+            self.chains[key] = sus.link_chains(channel)
+        self._dirty.clear()
@@ -0,0 +1,407 @@
+import math
+import mmap
+import struct
+from array import array
+from . import c2s
+from . import sus
+from .columnar import COLUMNS, FORMAT_C2S, FORMAT_SUS, ChartColumns
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAGIC = b"SUSPECT\x00"
+VERSION = 1
+
+_FORMATS = (FORMAT_SUS, FORMAT_C2S)
+
+# Sections of a snapshot, in file order. The header holds the offset and
+# record count of each, after the magic, version, format and resolution.
+SECTIONS = (
+    "notes",
+    "extras",
+    "definitions",
+    "keyframes",
+    "channels",
+    "strings",
+    "blob",
+)
+_HEADER = struct.Struct("<8sHBxI" + "QQ" * len(SECTIONS))
+
+# One record per note, holding every ChartColumns column
+_NOTE = struct.Struct("<qqiibbbbbbxx")
+_NOTE_FIELDS = (
+    "tick",
+    "length",
+    "channel",
+    "extra",
+    "lane",
+    "width",
+    "kind",
+    "type",
+    "end_lane",
+    "end_width",
+)
+_NOTE_TYPECODES = dict(COLUMNS, extra="i")
+
+# (speed, attribute) of sus notes, as indices of definition records (-1 is None)
+_EXTRA = struct.Struct("<ii")
+
+# One record per definition: class, whether it is one of the chart's objects
+# or only referenced by them, a string, four integers and three floats.
+# What the fields mean depends on the class, see _pack_definition().
+_DEFINITION = struct.Struct("<BBxxiqqqqddd")
+_DEFINITION_CLASSES = (
+    sus.Request,
+    sus.WaveOffset,
+    sus.BpmDefinition,
+    sus.BarLength,
+    sus.BpmChange,
+    sus.AttributeDefinition,
+    sus.SpeedDefinition,
+    c2s.BpmSetting,
+    c2s.MeterSetting,
+    c2s.SpeedSetting,
+)
+_DEFINITION_TAGS = {cls: tag for tag, cls in enumerate(_DEFINITION_CLASSES)}
+
+# (measure, tick, speed) keyframes of speed definitions
+_KEYFRAME = struct.Struct("<qqd")
+# Channel names, as string indices
+_CHANNEL = struct.Struct("<i")
+# (offset, length) of each string in the blob
+_STRING = struct.Struct("<II")
+
+_RECORDS = {
+    "notes": _NOTE,
+    "extras": _EXTRA,
+    "definitions": _DEFINITION,
+    "keyframes": _KEYFRAME,
+    "channels": _CHANNEL,
+    "strings": _STRING,
+}
+
+if numpy is not None:
+    _NOTE_DTYPE = numpy.dtype(
+        {
+            "names": list(_NOTE_FIELDS),
+            "formats": ["<i8", "<i8", "<i4", "<i4", "i1", "i1", "i1", "i1", "i1", "i1"],
+            "offsets": [0, 8, 16, 20, 24, 25, 26, 27, 28, 29],
+            "itemsize": _NOTE.size,
+        }
+    )
+
+
+def _optional(value):
+    return math.nan if value is None else value
+
+
+def _from_optional(value):
+    return None if math.isnan(value) else value
+
+
+class _Writer:
+    def __init__(self):
+        self.definitions = []
+        self.definition_ids = {}
+        self.keyframes = []
+        self.strings = []
+        self.string_ids = {}
+
+    def string(self, value):
+        if value is None:
+            return -1
+        i = self.string_ids.get(value)
+        if i is None:
+            i = self.string_ids[value] = len(self.strings)
+            self.strings.append(value)
+        return i
+
+    def definition(self, obj, listed=False):
+        """
+        Index of the record of a definition, adding it and what it refers to if needed.
+        """
+        if obj is None:
+            return -1
+        i = self.definition_ids.get(id(obj))
+        if i is not None:
+            return i
+        tag = _DEFINITION_TAGS.get(type(obj))
+        if tag is None:
+            raise ValueError(
+                "Can't store %s objects in a snapshot" % type(obj).__name__
+            )
+        record = self._pack_definition(obj)
+        i = self.definition_ids[id(obj)] = len(self.definitions)
+        self.definitions.append((tag, listed) + record)
+        return i
+
+    def _pack_definition(self, obj):
+        # (string, a, b, c, d, x, y, z)
+        if isinstance(obj, sus.Request):
+            return (self.string(obj.content), 0, 0, 0, 0, 0.0, 0.0, 0.0)
+        if isinstance(obj, sus.WaveOffset):
+            return (-1, 0, 0, 0, 0, obj.offset, 0.0, 0.0)
+        if isinstance(obj, sus.BpmDefinition):
+            return (self.string(obj.identifier), 0, 0, 0, 0, obj.tempo, 0.0, 0.0)
+        if isinstance(obj, sus.BarLength):
+            return (-1, obj.measure, obj.length, 0, 0, 0.0, 0.0, 0.0)
+        if isinstance(obj, sus.BpmChange):
+            definition = self.definition(obj.definition)
+            return (-1, obj.measure, definition, 0, 0, 0.0, 0.0, 0.0)
+        if isinstance(obj, sus.AttributeDefinition):
+            return (
+                self.string(obj.identifier),
+                0,
+                0,
+                0,
+                0,
+                _optional(obj.roll_speed),
+                _optional(obj.height),
+                _optional(obj.priority),
+            )
+        if isinstance(obj, sus.SpeedDefinition):
+            first = len(self.keyframes)
+            self.keyframes.extend(obj.speeds)
+            count = len(obj.speeds)
+            return (self.string(obj.identifier), first, count, 0, 0, 0.0, 0.0, 0.0)
+        if isinstance(obj, c2s.BpmSetting):
+            return (-1, obj.measure, obj.tick, 0, 0, obj.bpm, 0.0, 0.0)
+        if isinstance(obj, c2s.MeterSetting):
+            (numerator, denominator) = obj.signature
+            return (-1, obj.measure, obj.tick, numerator, denominator, 0.0, 0.0, 0.0)
+        # c2s.SpeedSetting
+        return (-1, obj.measure, obj.tick, obj.length, 0, obj.speed, 0.0, 0.0)
+
+
+def save(filename, chart):
+    """
+    Write ChartColumns to a snapshot file.
+    """
+    writer = _Writer()
+    for obj in chart.definitions:
+        writer.definition(obj, listed=True)
+    extras = [
+        (writer.definition(speed), writer.definition(attribute))
+        for speed, attribute in chart.extras
+    ]
+    channels = [writer.string(channel) for channel in chart.channels]
+
+    blob = bytearray()
+    strings = []
+    for value in writer.strings:
+        data = value.encode("utf-8")
+        strings.append((len(blob), len(data)))
+        blob += data
+
+    columns = [getattr(chart, name) for name in _NOTE_FIELDS]
+    sections = {
+        "notes": b"".join(_NOTE.pack(*row) for row in zip(*columns)),
+        "extras": b"".join(_EXTRA.pack(*extra) for extra in extras),
+        "definitions": b"".join(_DEFINITION.pack(*d) for d in writer.definitions),
+        "keyframes": b"".join(_KEYFRAME.pack(*k) for k in writer.keyframes),
+        "channels": b"".join(_CHANNEL.pack(channel) for channel in channels),
+        "strings": b"".join(_STRING.pack(*string) for string in strings),
+        "blob": bytes(blob),
+    }
+
+    header = []
+    offset = _HEADER.size
+    for name in SECTIONS:
+        data = sections[name]
+        count = len(data) // _RECORDS[name].size if name in _RECORDS else len(data)
+        header += [offset, count]
+        offset += len(data)
+
+    f = open(filename, "wb")
+    f.write(
+        _HEADER.pack(
+            MAGIC,
+            VERSION,
+            _FORMATS.index(chart.format),
+            chart.timeline.ticks_per_measure,
+            *header
+        )
+    )
+    for name in SECTIONS:
+        f.write(sections[name])
+    f.close()
+
+
+def save_sus(filename, sus_objects, ticks_per_measure=sus.SUS_TICKS_PER_MEASURE):
+    """
+    Write parsed SUS objects, such as the result of read_sus(), to a snapshot file.
+    """
+    save(filename, ChartColumns.from_sus(sus_objects, ticks_per_measure))
+
+
+def save_c2s(filename, c2s_objects, ticks_per_measure=c2s.C2S_TICKS_PER_MEASURE):
+    """
+    Write parsed c2s objects, such as the result of read_c2s(), to a snapshot file.
+    """
+    save(filename, ChartColumns.from_c2s(c2s_objects, ticks_per_measure))
+
+
+class Snapshot:
+    """
+    A snapshot file mapped into memory with mmap.
+
+    Opening one only reads the header. Note records are read as a whole when
+    they are asked for, straight from the mapping as a NumPy structured array
+    when NumPy is installed; definitions and strings are only decoded when
+    building the object model.
+    """
+
+    def __init__(self, filename):
+        f = open(filename, "rb")
+        self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        f.close()
+
+        if len(self.mmap) < _HEADER.size or self.mmap[:8] != MAGIC:
+            self.close()
+            raise ValueError("%s is not a chart snapshot" % filename)
+        header = _HEADER.unpack_from(self.mmap)
+        if header[1] != VERSION:
+            self.close()
+            raise ValueError(
+                "%s is a version %s snapshot, expected version %s"
+                % (filename, header[1], VERSION)
+            )
+        self.format = _FORMATS[header[2]]
+        self.ticks_per_measure = header[3]
+        self.sections = {
+            name: (header[4 + 2 * i], header[5 + 2 * i])
+            for i, name in enumerate(SECTIONS)
+        }
+
+    def close(self):
+        """
+        Release the mapping. Arrays returned by notes() view the mapping, so while
+        any of them is alive the file stays mapped, and is unmapped once the last
+        one is garbage collected.
+        """
+        try:
+            self.mmap.close()
+        except BufferError:
+            # Views from notes() still point into the mapping, and keep it alive
+            pass
+        self.mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.sections["notes"][1]
+
+    def _records(self, name):
+        (offset, count) = self.sections[name]
+        record = _RECORDS[name]
+        return record.iter_unpack(self.mmap[offset : offset + count * record.size])
+
+    def notes(self):
+        """
+        The note records, as a NumPy structured array viewing the mapping if NumPy
+        is installed, or as a list of tuples otherwise. The array stays valid after
+        the snapshot is closed.
+        """
+        if numpy is None:
+            return list(self._records("notes"))
+        (offset, count) = self.sections["notes"]
+        return numpy.frombuffer(
+            self.mmap, dtype=_NOTE_DTYPE, count=count, offset=offset
+        )
+
+    def strings(self):
+        (offset, _) = self.sections["blob"]
+        return [
+            bytes(self.mmap[offset + start : offset + start + length]).decode("utf-8")
+            for start, length in self._records("strings")
+        ]
+
+    def columns(self):
+        """
+        Load the chart as ChartColumns.
+        """
+        strings = self.strings()
+        keyframes = list(self._records("keyframes"))
+        definitions = []
+        listed = []
+        for record in self._records("definitions"):
+            obj = self._unpack_definition(record, strings, keyframes, definitions)
+            definitions.append(obj)
+            if record[1]:
+                listed.append(obj)
+
+        if self.format == FORMAT_SUS:
+            timeline = sus.build_timeline(listed, self.ticks_per_measure)
+        else:
+            timeline = c2s.build_timeline(listed, self.ticks_per_measure)
+        chart = ChartColumns(self.format, timeline)
+        chart.definitions = listed
+        chart.channels = [strings[i] for (i,) in self._records("channels")]
+        chart.extras = [
+            (
+                definitions[speed] if speed >= 0 else None,
+                definitions[attribute] if attribute >= 0 else None,
+            )
+            for speed, attribute in self._records("extras")
+        ]
+
+        notes = self.notes()
+        if numpy is not None:
+            for name in _NOTE_FIELDS:
+                column = array(_NOTE_TYPECODES[name])
+                column.frombytes(notes[name].tobytes())
+                setattr(chart, name, column)
+        else:
+            columns = list(zip(*notes)) or [()] * len(_NOTE_FIELDS)
+            for name, values in zip(_NOTE_FIELDS, columns):
+                setattr(chart, name, array(_NOTE_TYPECODES[name], values))
+        return chart
+
+    def objects(self):
+        """
+        Load the chart into the object model, as ChartColumns.to_objects() does.
+        """
+        return self.columns().to_objects()
+
+    @staticmethod
+    def _unpack_definition(record, strings, keyframes, definitions):
+        (tag, _, string, a, b, c, d, x, y, z) = record
+        cls = _DEFINITION_CLASSES[tag]
+        string = strings[string] if string >= 0 else None
+        if cls is sus.Request:
+            return sus.Request(string)
+        if cls is sus.WaveOffset:
+            return sus.WaveOffset(x)
+        if cls is sus.BpmDefinition:
+            return sus.BpmDefinition(string, x)
+        if cls is sus.BarLength:
+            return sus.BarLength(a, b)
+        if cls is sus.BpmChange:
+            return sus.BpmChange(a, definitions[b])
+        if cls is sus.AttributeDefinition:
+            return sus.AttributeDefinition(
+                string, _from_optional(x), _from_optional(y), _from_optional(z)
+            )
+        if cls is sus.SpeedDefinition:
+            obj = sus.SpeedDefinition(string)
+            obj.speeds = keyframes[a : a + b]
+            return obj
+        if cls is c2s.BpmSetting:
+            return c2s.BpmSetting(a, b, x)
+        if cls is c2s.MeterSetting:
+            return c2s.MeterSetting(a, b, (c, d))
+        return c2s.SpeedSetting(a, b, c, x)
+
+
+def load(filename):
+    """
+    Load a snapshot file into the object model: the chart's definitions, then its notes.
+    """
+    with Snapshot(filename) as snapshot:
+        return snapshot.objects()
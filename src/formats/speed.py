@@ -0,0 +1,69 @@
+from bisect import bisect_right
+
+DEFAULT_SPEED = 1.0
+
+
+class SpeedTimeline:
+    """
+    Scroll speed of a chart, as intervals of constant speed.
+
+    Each interval starts at an absolute tick of the chart's Timeline and lasts
+    until the next one starts. Keyframes that don't change the speed are merged
+    into the interval before them, so consecutive intervals always differ, and
+    the speed at a tick is found with one bisect.
+    """
+
+    def __init__(self, timeline, keyframes=(), default_speed=DEFAULT_SPEED):
+        """
+        Args:
+            timeline: Timeline of the chart
+            keyframes: (absolute tick, speed) pairs, in any order. A speed applies
+                from its tick until the next one. Later pairs for the same tick win
+            default_speed: Speed before the first keyframe
+        """
+        self.timeline = timeline
+        self.default_speed = default_speed
+
+        changes = {0: default_speed}
+        for tick, speed in keyframes:
+            changes[tick] = speed
+
+        # Start tick and speed of each interval
+        self.ticks = []
+        self.speeds = []
+        for tick in sorted(changes):
+            speed = changes[tick]
+            if self.speeds and speed == self.speeds[-1]:
+                continue
+            self.ticks.append(tick)
+            self.speeds.append(speed)
+
+    def __len__(self):
+        return len(self.ticks)
+
+    def speed_at(self, absolute):
+        """
+        Speed at an absolute tick.
+        """
+        i = bisect_right(self.ticks, absolute) - 1
+        if i < 0:
+            return self.default_speed
+        return self.speeds[i]
+
+    def speed(self, measure, tick):
+        """
+        Speed at a (measure, tick) position.
+        """
+        return self.speed_at(self.timeline.absolute(measure, tick))
+
+    def intervals(self, end):
+        """
+        (start, stop, speed) of each interval that starts before an absolute tick,
+        with the last one cut off at that tick.
+        """
+        stops = self.ticks[1:] + [end]
+        return [
+            (start, min(stop, end), speed)
+            for start, stop, speed in zip(self.ticks, stops, self.speeds)
+            if start < end
+        ]
@@ -1,6 +1,15 @@
 from abc import ABC, abstractmethod
 from enum import Enum
-from collections import defaultdict
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import re
+from functools import reduce
+from math import gcd
+from string import ascii_letters, ascii_lowercase, digits
+from .diagnostics import PrintSink
+from .speed import SpeedTimeline
+from .tempo import TempoMap
+from .timeline import DEFAULT_BEATS, Timeline
 
 SUS_TICKS_PER_MEASURE = 480 * 4
 
@@ -38,460 +47,745 @@ class LongNoteKind(Enum):
 
 
 class SusContext:
-    active_attribute = None
-    active_speed = None
-    base_measure = 0
-    ticks_per_measure = SUS_TICKS_PER_MEASURE
+    """
+    State of one chart being parsed: definitions, active regions and long note channels.
 
-    bpm_definitions = {}
-    attribute_definitions = {}
-    speed_definitions = {}
+    Each chart needs its own context (or a reset() one), and a context must only
+    be used from one thread at a time. Contexts can be used as context managers,
+    which close() them on exit.
+    """
 
-    channels = {}
+    def __init__(self, diagnostics=None):
+        self.diagnostics = diagnostics if diagnostics is not None else PrintSink()
+        self.ticks_per_measure = SUS_TICKS_PER_MEASURE
+        self.reset()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def reset(self):
+        """
+        Forget everything parsed so far, so the context can parse another chart.
+
+        Objects returned by earlier parses keep their own channel links.
+        """
+        self.active_attribute = None
+        self.active_speed = None
+        self.base_measure = 0
+
+        self.bpm_definitions = {}
+        self.attribute_definitions = {}
+        self.speed_definitions = {}
+        self.bar_lengths = []  # (measure, beats) of every bar length change
+        self.timeline = None  # Built by finalize()
+
+        self.channels = {}
+        self.chains = []
+
+    def close(self):
+        """
+        Release the parse state held by this context.
+        """
+        self.reset()
+
+    def finalize(self):
+        """
+        Put every long note channel in time order, repair it with fix_channels(),
+        then split it into START...END chains with link_chain().
+
+        Call this once all lines have been parsed; channels are unsorted until then.
+        """
+        self.timeline = Timeline(self.ticks_per_measure, self.bar_lengths)
+        for channel in self.channels.values():
+            self.timeline.sort(channel)
+        self.fix_channels()
+        for channel in self.channels.values():
+            self.chains.extend(link_chains(channel))
 
     def fix_channels(self):
         for key in self.channels:
-            channel = self.channels[key]
-            for i in range(len(channel) - 1):
-
-                if (
-                    channel[i].note_kind != channel[i + 1].note_kind
-                    and channel[i].note_type != LongNoteType["END"]
-                ):
-                    print(
-                        "Replaced %s:%s with END at index %s on channel %s (next note was %s:%s)"
-                        % (
-                            channel[i].note_kind,
-                            channel[i].note_type,
-                            i,
-                            key,
-                            channel[i + 1].note_kind,
-                            channel[i + 1].note_type,
-                        )
-                    )
-                    channel[i].note_type = LongNoteType["END"]
-
-                if (
-                    channel[i].note_type != LongNoteType["END"]
-                    and channel[i + 1].note_type == LongNoteType["START"]
-                ):
-                    print(
-                        "Replaced %s:%s with END at index %s on channel %s (next note was %s:%s)"
-                        % (
-                            channel[i].note_kind,
-                            channel[i].note_type,
-                            i,
-                            key,
-                            channel[i + 1].note_kind,
-                            channel[i + 1].note_type,
-                        )
-                    )
-                    channel[i].note_type = LongNoteType["END"]
-
-            if channel[-1].note_type != LongNoteType["END"]:
-                channel[-1].note_type = LongNoteType["END"]
-                print("Fixed last note of channel %s that was not an END" % key)
+            self.fix_channel(key, self.channels[key])
+
+    def fix_channel(self, key, channel):
+        """
+        Repair a time ordered channel in place, turning the notes that a chain
+        can't continue from into END notes.
+        """
+        end = LongNoteType.END
+        start = LongNoteType.START
+        for i in range(len(channel) - 1):
+
+            if (
+                channel[i].note_kind != channel[i + 1].note_kind
+                and channel[i].note_type != end
+            ):
+                self.diagnostics.warning(
+                    "channel-kind-change",
+                    "Replaced %s:%s with END at index %s on channel %s (next note was %s:%s)",
+                    channel[i].note_kind,
+                    channel[i].note_type,
+                    i,
+                    key,
+                    channel[i + 1].note_kind,
+                    channel[i + 1].note_type,
+                )
+                channel[i].note_type = end
+
+            if channel[i].note_type != end and channel[i + 1].note_type == start:
+                self.diagnostics.warning(
+                    "channel-restart",
+                    "Replaced %s:%s with END at index %s on channel %s (next note was %s:%s)",
+                    channel[i].note_kind,
+                    channel[i].note_type,
+                    i,
+                    key,
+                    channel[i + 1].note_kind,
+                    channel[i + 1].note_type,
+                )
+                channel[i].note_type = end
+
+        if channel[-1].note_type != end:
+            channel[-1].note_type = end
+            self.diagnostics.warning(
+                "channel-unterminated",
+                "Fixed last note of channel %s that was not an END",
+                key,
+            )
 
 
 class SusObject(ABC):
-    attribute = None
-    speed = None
+    __slots__ = ("attribute", "speed")
+
+    def __init__(self):
+        self.attribute = None
+        self.speed = None
 
 
 class BarLength(SusObject):
-    measure = 0
-    length = 0
+    __slots__ = ("measure", "length")
+
+    def __init__(self, measure=0, length=0):
+        super().__init__()
+        self.measure = measure
+        self.length = length
 
 
 class BpmDefinition(SusObject):
-    identifier = 0
-    tempo = 0.0
+    __slots__ = ("identifier", "tempo")
+
+    def __init__(self, identifier=0, tempo=0.0):
+        super().__init__()
+        self.identifier = identifier
+        self.tempo = tempo
+
+
+class WaveOffset(SusObject):
+    __slots__ = ("offset",)
+
+    def __init__(self, offset=0.0):
+        super().__init__()
+        self.offset = offset  # Seconds the chart starts before the audio
 
 
 class BpmChange(SusObject):
-    measure = 0
-    definition = None
+    __slots__ = ("measure", "definition")
+
+    def __init__(self, measure=0, definition=None):
+        super().__init__()
+        self.measure = measure
+        self.definition = definition
 
 
 class Request(SusObject):
-    content = ""
+    __slots__ = ("content",)
 
-    def __init__(self, content):
+    def __init__(self, content=""):
+        super().__init__()
         self.content = content
 
 
 class AttributeDefinition(SusObject):
-    identifier = 0
-    roll_speed = None
-    height = None
-    priority = None
+    __slots__ = ("identifier", "roll_speed", "height", "priority")
+
+    def __init__(self, identifier=0, roll_speed=None, height=None, priority=None):
+        super().__init__()
+        self.identifier = identifier
+        self.roll_speed = roll_speed
+        self.height = height
+        self.priority = priority
 
 
 class SpeedDefinition(SusObject):
-    identifier = 0
-    speeds = []
+    __slots__ = ("identifier", "speeds")
+
+    def __init__(self, identifier=0):
+        super().__init__()
+        self.identifier = identifier
+        self.speeds = []
 
     def add_speed(self, measure, tick, speed):
         self.speeds.append((measure, tick, speed))
 
 
 class ShortNote(SusObject):
-    measure = 0
-    tick = 0
-    lane = 0
-    width = 0
-    note_type = TapNoteType(1)
+    __slots__ = ("measure", "tick", "lane", "width", "note_type")
+
+    def __init__(self, measure=0, tick=0, lane=0, width=0, note_type=TapNoteType(1)):
+        super().__init__()
+        self.measure = measure
+        self.tick = tick
+        self.lane = lane
+        self.width = width
+        self.note_type = note_type
 
 
 class LongNote(SusObject):
-    measure = 0
-    tick = 0
-    lane = 0
-    width = 0
-    note_kind = LongNoteKind(2)
-    note_type = LongNoteType(1)
-    linked = []
-    channel = None  # Channel identifier for grouping long notes
+    __slots__ = (
+        "measure",
+        "tick",
+        "lane",
+        "width",
+        "note_kind",
+        "note_type",
+        "linked",
+        "prev_note",
+        "next_note",
+        "channel",  # Channel identifier for grouping long notes
+    )
+
+    def __init__(
+        self,
+        measure=0,
+        tick=0,
+        lane=0,
+        width=0,
+        note_kind=LongNoteKind(2),
+        note_type=LongNoteType(1),
+        channel=None,
+    ):
+        super().__init__()
+        self.measure = measure
+        self.tick = tick
+        self.lane = lane
+        self.width = width
+        self.note_kind = note_kind
+        self.note_type = note_type
+        # The notes of this long note, from START to END, and this note's neighbours
+        self.linked = ()
+        self.prev_note = None
+        self.next_note = None
+        self.channel = channel
+
+
+def link_chains(channel):
+    """
+    Split a time ordered long note channel into chains, each running up to and
+    including an END note, and link the notes of each chain together.
 
+    Every note gets its chain as `linked`, and the notes next to it in the chain
+    as `prev_note` and `next_note`.
 
-def from_string(sus_string: str, context: SusContext):
-    if sus_string[0] != "#":
-        print("Ignoring line that doesn't start with #")
-        return []
+    Returns:
+        List of chains
+    """
+    chains = []
+    chain = []
+    for note in channel:
+        if chain:
+            chain[-1].next_note = note
+            note.prev_note = chain[-1]
+        else:
+            note.prev_note = None
+        note.next_note = None
+        note.linked = chain
+        chain.append(note)
+        if note.note_type == LongNoteType.END:
+            chains.append(chain)
+            chain = []
+    if chain:
+        chains.append(chain)
+    return chains
+
+
+# Data line headers are `mmmcx[y]` with a 3-digit measure, or `mmmmmcx[y]` with
+# a 5-digit one, so one match pulls out the measure, note type, lane and channel
+# at once. The shapes overlap at 6 characters (`mmmcxy` and `mmmmmc`): fullmatch
+# tries the 3-digit measure first and only falls back to 5 digits when that can't
+# cover the header, so a 6-character header always has a 3-digit measure, lane
+# and channel. 5-digit measures are read from 7 and 8 character headers.
+_NOTE_HEADER = re.compile(r"(\d{3}|\d{5})(\d)([0-9a-zA-Z]?)([0-9a-zA-Z]?)")
+
+_BASE36 = {c: int(c, 36) for c in digits + ascii_letters}
+
+
+def _parse_hispeed(header, context):
+    context.active_speed = context.speed_definitions[header.split()[1].strip()]
+    context.diagnostics.debug("speed-region", "Speed region start")
+    return []
 
-    sus_string = sus_string[1:]
-    split = sus_string.split(":", 2)
-    header = split[0]
-    # Speed regions
-    if header.startswith("HISPEED"):
-        context.active_speed = context.speed_definitions[header.split()[1].strip()]
-        print("Speed region start")
-        return []
-    if header.startswith("NOSPEED"):
-        context.active_speed = None
-        print("Speed region end")
-        return []
 
-    # Attribute regions
-    if header.startswith("ATTRIBUTE"):
-        context.active_attribute = context.attribute_definitions[
-            header.split()[1].strip()
-        ]
-        print("Attribute region start")
+def _parse_nospeed(header, context):
+    context.active_speed = None
+    context.diagnostics.debug("speed-region", "Speed region end")
+    return []
+
+
+def _parse_attribute(header, context):
+    context.active_attribute = context.attribute_definitions[header.split()[1].strip()]
+    context.diagnostics.debug("attribute-region", "Attribute region start")
+    return []
+
+
+def _parse_noattribute(header, context):
+    context.active_attribute = None
+    context.diagnostics.debug("attribute-region", "Attribute region end")
+    return []
+
+
+def _parse_measurebs(header, context):
+    context.base_measure = int(header.split()[1])
+    context.diagnostics.debug("base-measure", "Base measure number updated")
+    return []
+
+
+def _parse_waveoffset(header, context):
+    obj = WaveOffset(float(header.split()[1]))
+    context.diagnostics.debug("wave-offset", "Registered wave offset")
+    return [obj]
+
+
+def _parse_bpm_definition(identifier, data, context):
+    # BPM definition. The header contains the ID, and the data payload is a float specifying the BPM to use from now on.
+    obj = BpmDefinition()
+    obj.identifier = identifier
+    obj.tempo = float(data)
+    context.bpm_definitions[obj.identifier] = obj
+    context.diagnostics.debug("bpm-definition", "Registered BPM definition")
+    return []
+
+
+def _parse_attribute_definition(identifier, data, context):
+    # Attribute definition. Parse attribute string.
+    obj = AttributeDefinition()
+    obj.identifier = identifier
+    for definition in data.replace('"', "").split(","):
+        try:
+            (attr, val) = definition.split(":")
+            attr = attr.strip()
+            if attr == "rh":
+                obj.roll_speed = float(val)
+            if attr == "h":
+                obj.height = float(val)
+            if attr == "pr":
+                obj.priority = float(val)
+        except ValueError:
+            continue
+
+    context.attribute_definitions[obj.identifier] = obj
+    context.diagnostics.debug(
+        "attribute-definition", "Registered attribute definition"
+    )
+    return []
+
+
+def _parse_speed_definition(identifier, data, context):
+    # Speed change definition. Parse speed change string.
+    obj = SpeedDefinition()
+    obj.identifier = identifier
+    for definition in data.replace('"', "").replace("'", ":").split(","):
+        try:
+            (bar, tick, speed) = definition.split(":")
+            obj.add_speed(int(bar), int(tick), float(speed))
+        except ValueError:
+            continue
+
+    context.speed_definitions[obj.identifier] = obj
+    context.diagnostics.debug("speed-definition", "Registered speed definition")
+    return []
+
+
+def _parse_pairs(data, context):
+    """
+    Split a note payload into (tick, type, width) triples, skipping empty (`0?`) slots.
+    """
+    count = len(data) // 2
+    if count == 0:
         return []
-    if header.startswith("NOATTRIBUTE"):
-        context.active_attribute = None
-        print("Attribute region end")
+    tick_subdivision = context.ticks_per_measure // count
+    return [
+        (tick_subdivision * (i // 2), _BASE36[data[i]], _BASE36[data[i + 1]])
+        for i in range(0, count * 2, 2)
+        if data[i] != "0"
+    ]
+
+
+def _parse_measure_setting(measure, note_type, lane, channel, data, context):
+    if lane == "2":
+        # Bar length change. The data payload is an integer specifying the bar length in beats.
+        obj = BarLength()
+        obj.measure = measure
+        obj.length = int(data)
+        context.bar_lengths.append((obj.measure, obj.length))
+        context.diagnostics.debug("bar-length", "Applying bar length change")
+        return [obj]
+    if lane == "8":
+        # BPM change. The data payload is an in integer referencing the BPM definition to use.
+        obj = BpmChange()
+        obj.measure = measure
+        obj.definition = context.bpm_definitions[data]
+        context.diagnostics.debug("bpm-change", "Applying BPM change")
+        return [obj]
+    return None
+
+
+def _parse_short_notes(measure, note_type, lane, channel, data, context):
+    if not lane:
+        return None
+    note_enum = TapNoteType if note_type == "1" else AirNoteType
+    lane = _BASE36[lane]
+    objects = []
+    for tick, tap_type, width in _parse_pairs(data, context):
+        obj = ShortNote(measure, tick, lane, width, note_enum(tap_type))
+        obj.speed = context.active_speed
+        obj.attribute = context.active_attribute
+        objects.append(obj)
+
+    context.diagnostics.debug("short-notes", "Found %s short notes", len(objects))
+    return objects
+
+
+def _parse_long_notes(measure, note_type, lane, channel, data, context):
+    if not lane:
+        return None
+    if not channel:
+        context.diagnostics.warning(
+            "long-note-header", "Warning: Long note header too short, skipping"
+        )
         return []
 
-    # Set base measure
-    if header.startswith("MEASUREBS"):
-        context.base_measure = int(header.split()[1])
-        print("Base measure number updated")
+    note_kind = LongNoteKind(int(note_type))  # Hold, slide, or air hold
+    lane = _BASE36[lane]
+
+    objects = []
+    for tick, long_type, width in _parse_pairs(data, context):
+        obj = LongNote(
+            measure,
+            tick,
+            lane,
+            width,
+            note_kind,
+            LongNoteType(long_type),  # Start, tick, curve point, end, etc
+            channel,  # Set the channel for linking notes
+        )
+        obj.speed = context.active_speed
+        obj.attribute = context.active_attribute
+        objects.append(obj)
+
+    # Add the objects to their channel once the whole line parsed, so a bad pair
+    # leaves the context as it was. Channels are put in time order and split into
+    # linked chains once, by SusContext.finalize()
+    context.channels.setdefault(channel, []).extend(objects)
+    context.diagnostics.debug("long-notes", "Found %s long notes", len(objects))
+    return objects
+
+
+# Region and metadata lines, keyed on their leading keyword. No data payload.
+_REGION_HANDLERS = {
+    "WAVEOFFSET": _parse_waveoffset,
+    "HISPEED": _parse_hispeed,
+    "NOSPEED": _parse_nospeed,
+    "ATTRIBUTE": _parse_attribute,
+    "NOATTRIBUTE": _parse_noattribute,
+    "MEASUREBS": _parse_measurebs,
+}
+
+# Definition lines (`#BPMzz: ...`), keyed on the 3-letter prefix of the header.
+_DEFINITION_HANDLERS = {
+    "BPM": _parse_bpm_definition,
+    "ATR": _parse_attribute_definition,
+    "TIL": _parse_speed_definition,
+}
+
+# Data lines, keyed on the note type digit. Handlers return None for headers
+# they can't make sense of, which are reported as unsupported.
+_NOTE_HANDLERS = {
+    "0": _parse_measure_setting,
+    "1": _parse_short_notes,
+    "2": _parse_long_notes,
+    "3": _parse_long_notes,
+    "4": _parse_long_notes,
+    "5": _parse_short_notes,
+}
+
+
+def from_string(sus_string: str, context: SusContext):
+    if sus_string[:1] != "#":
+        context.diagnostics.debug(
+            "ignored-line", "Ignoring line that doesn't start with #"
+        )
         return []
 
-    # Bar speed changes unsupported for now
-
-    if len(split) != 1:
-        data = split[1].strip()
-        measure = header[:3]
-
-        if measure == "BPM":
-            # BPM definition. The header contains the ID, and the data payload is a float specifying the BPM to use from now on.
-            obj = BpmDefinition()
-            obj.identifier = header[3:5]
-            obj.tempo = float(data)
-            context.bpm_definitions[obj.identifier] = obj
-
-            print("Registered BPM definition")
-
-            return []
-        if measure == "ATR":
-            # Attribute definition. Parse attribute string.
-            obj = AttributeDefinition()
-            obj.identifier = header[3:5]
-            defstring = data.replace('"', "").split(",")
-            for definition in defstring:
-                try:
-                    (attr, val) = definition.split(":")
-                    if attr == "rh":
-                        obj.roll_speed = float(val)
-                    if attr == "h":
-                        obj.height = float(val)
-                    if attr == "pr":
-                        obj.priority = float(val)
-                except:
-                    continue
-
-            context.attribute_definitions[obj.identifier] = obj
-            print("Registered attribute definition")
-
-            return []
-        if measure == "TIL":
-            # Speed change definition. Parse speed change string.
-            obj = SpeedDefinition()
-            obj.identifier = header[3:5]
-            defstring = data.replace('"', "").replace("'", ":").split(",")
-            for definition in defstring:
-                try:
-                    (bar, tick, speed) = definition.split(":")
-                    obj.add_speed(int(bar), int(tick), float(speed))
-                except:
-                    continue
-
-            context.speed_definitions[obj.identifier] = obj
-
-            print("Registered speed definition")
-
-            return []
-        else:
-            # Check if this is a 3-digit or 5-digit measure format
-            if len(header) >= 6 and header[0:5].isdigit():
-                # 5-digit format: mmmmm (5 chars for measure)
-                measure = header[:5]
-                # Make sure we have enough characters for note_type
-                if len(header) > 5:
-                    note_type = header[5]
-                    measure_value = int(measure) + context.base_measure
-
-                    if note_type == "0" and len(header) > 6:  # BPM or bar length change
-                        change_type = header[6]
-                        if change_type == "2":
-                            # Bar length change
-                            obj = BarLength()
-                            obj.measure = measure_value
-                            obj.length = int(data)
-                            print("Applying bar length change")
-                            return [obj]
-                        if change_type == "8":
-                            # BPM change
-                            obj = BpmChange()
-                            obj.measure = measure_value
-                            obj.definition = context.bpm_definitions[data]
-                            print("Applying BPM change")
-                            return [obj]
-
-                # Handle other 5-digit format notes here
-                # Remove whitespace from data
-                data = "".join(data.split())
-
-                # Handle potentially empty data
+    (header, separator, data) = sus_string[1:].partition(":")
+
+    if separator:
+        match = _NOTE_HEADER.fullmatch(header)
+        if match is not None:
+            (measure, note_type, lane, channel) = match.groups()
+            handler = _NOTE_HANDLERS.get(note_type)
+            if handler is not None:
+                data = data.strip()
+                if not data.isalnum():
+                    # Remove whitespace from data
+                    data = "".join(data.split())
                 if not data:
-                    print("Warning: Empty data for note, skipping")
-                    return []
-
-                tick_subdivision = context.ticks_per_measure // (len(data) // 2)
-                parsed_data = [
-                    (
-                        tick_subdivision * (i // 2),
-                        int(data[i], 36),
-                        int(data[i + 1], 36),
+                    context.diagnostics.warning(
+                        "empty-note-data", "Warning: Empty data for note, skipping"
                     )
-                    for i in range(0, len(data), 2)
-                    if i + 1 < len(data)
-                ]
-
-                if len(header) > 6 and (
-                    note_type == "1" or note_type == "5"
-                ):  # Tap or air note
-                    lane = int(header[6], 36)  # Use base-36 for lanes
-                    objects = []
-                    for tick, tap_type, width in parsed_data:
-                        if tap_type == 0:
-                            # Skip 0 entries
-                            continue
-
-                        obj = ShortNote()
-                        obj.lane = lane
-                        obj.measure = measure_value
-                        obj.tick = tick
-                        if note_type == "1":
-                            obj.note_type = TapNoteType(tap_type)
-                        else:
-                            obj.note_type = AirNoteType(tap_type)
-                        obj.width = width
-                        obj.speed = context.active_speed
-                        obj.attribute = context.active_attribute
-                        objects.append(obj)
-
-                    print(f"Found {len(objects)} short notes")
+                    return []
+                measure = int(measure) + context.base_measure
+                objects = handler(measure, note_type, lane, channel, data, context)
+                if objects is not None:
                     return objects
+        else:
+            handler = _DEFINITION_HANDLERS.get(header[:3])
+            if handler is not None:
+                return handler(header[3:5], data.strip(), context)
+    else:
+        keyword = header.split(None, 1)
+        handler = _REGION_HANDLERS.get(keyword[0]) if keyword else None
+        if handler is not None:
+            return handler(header, context)
+
+    context.diagnostics.info(
+        "unsupported-statement",
+        "Skipped unsupported statement\n%s",
+        sus_string[1:],
+    )
+    return []
+
+
+def build_timeline(sus_objects, ticks_per_measure=SUS_TICKS_PER_MEASURE):
+    """
+    Build the Timeline of a chart from the BarLength objects among its SUS objects.
+    """
+    return Timeline(
+        ticks_per_measure,
+        [
+            (obj.measure, obj.length)
+            for obj in sus_objects
+            if isinstance(obj, BarLength)
+        ],
+    )
 
-                if len(header) > 7 and (
-                    note_type == "2" or note_type == "3" or note_type == "4"
-                ):  # Hold, slide, or air hold note
-                    lane = int(header[6], 36)  # Use base-36 for lanes
-                    channel = header[7]
-
-                    objects = []
-                    for tick, long_type, width in parsed_data:
-                        if long_type == 0:
-                            # Skip 0 entries
-                            continue
-
-                        obj = LongNote()
-                        obj.note_kind = LongNoteKind(
-                            int(note_type)
-                        )  # Hold, slide, or air hold
-                        obj.note_type = LongNoteType(
-                            long_type
-                        )  # Start, tick, curve point, end, etc
-                        obj.lane = lane
-                        obj.measure = measure_value
-                        obj.tick = tick
-                        obj.width = width
-                        obj.speed = context.active_speed
-                        obj.attribute = context.active_attribute
-                        obj.channel = channel  # Set the channel for linking notes
-
-                        if not channel in context.channels.keys():
-                            context.channels[channel] = []
-
-                        # Add the object to its channel, and link it to the other objects in the same channel
-                        obj.linked = context.channels[channel]
-                        context.channels[channel].append(obj)
-
-                        # Sort the channel by time
-                        context.channels[channel].sort(
-                            key=lambda item: item.measure
-                            + item.tick / context.ticks_per_measure
-                        )
-
-                        objects.append(obj)
-                    print(f"Found {len(objects)} long notes")
-                    return objects
 
+def build_tempo_map(sus_objects, ticks_per_measure=SUS_TICKS_PER_MEASURE):
+    """
+    Build the TempoMap of a chart from its BarLength, BpmChange and WaveOffset objects.
+    """
+    sus_objects = list(sus_objects)
+    timeline = build_timeline(sus_objects, ticks_per_measure)
+    bpm_changes = []
+    offset = 0.0
+    for obj in sus_objects:
+        if isinstance(obj, BpmChange):
+            bpm_changes.append((timeline.absolute(obj.measure, 0), obj.definition.tempo))
+        elif isinstance(obj, WaveOffset):
+            offset = obj.offset
+    return TempoMap(timeline, bpm_changes, offset)
+
+
+def build_speed_timeline(sus_objects, ticks_per_measure=SUS_TICKS_PER_MEASURE):
+    """
+    Build the SpeedTimeline of a chart from the speed definition its notes use.
+
+    A chart has a single scroll speed in other formats, so when notes use
+    several speed definitions the one used by the most notes wins.
+
+    Unlike note ticks, the ticks of a speed change count ticks per beat from the
+    start of its measure, whatever the length of that measure.
+    """
+    sus_objects = list(sus_objects)
+    timeline = build_timeline(sus_objects, ticks_per_measure)
+    uses = Counter(
+        obj.speed
+        for obj in sus_objects
+        if isinstance(obj, (ShortNote, LongNote)) and obj.speed is not None
+    )
+    if not uses:
+        return SpeedTimeline(timeline)
+    definition = uses.most_common(1)[0][0]
+    # An absolute tick counts ticks_per_measure per beat
+    ticks_per_beat = ticks_per_measure // DEFAULT_BEATS
+    return SpeedTimeline(
+        timeline,
+        [
+            (
+                timeline.absolute(measure, 0)
+                + tick * ticks_per_measure // ticks_per_beat,
+                speed,
+            )
+            for measure, tick, speed in definition.speeds
+        ],
+    )
+
+
+def iter_parse(lines, context=None):
+    """
+    Parse the lines of a SUS file, yielding SUS objects as each line is parsed.
+
+    Long note channels are finalized after the last line, just before the generator
+    finishes. Until then long notes can still be reordered or have their type fixed.
+
+    Args:
+        lines: Iterable of lines, such as an open file
+        context: SusContext to parse with. A new one is used if not given
+    """
+    if context is None:
+        context = SusContext()
+
+    for line in lines:
+        yield from from_string(line, context)
+
+    context.finalize()
+
+
+def parse(lines, context=None):
+    """
+    Parse the lines of a SUS file.
+
+    Args:
+        lines: Iterable of lines, such as an open file
+        context: SusContext to parse with. A new one is used if not given
+
+    Returns:
+        List of SUS objects, with long note channels finalized
+    """
+    return list(iter_parse(lines, context))
+
+
+def parse_many(sources, max_workers=None, diagnostics=None):
+    """
+    Parse several SUS files on a thread pool, each in its own SusContext.
+
+    Args:
+        sources: Iterable of line iterables, one per chart
+        max_workers: Number of threads, see ThreadPoolExecutor
+        diagnostics: Callable returning the DiagnosticSink for each chart.
+            Sinks are not thread safe, so each chart gets its own
+
+    Returns:
+        List of parse() results, in the same order as sources
+    """
+
+    def parse_one(lines):
+        with SusContext(diagnostics() if diagnostics else None) as context:
+            return parse(lines, context)
+
+    with ThreadPoolExecutor(max_workers) as pool:
+        return list(pool.map(parse_one, sources))
+
+
+_BASE36_DIGITS = digits + ascii_lowercase
+
+
+def _base36(value):
+    if not 0 <= value < 36:
+        raise ValueError("%s doesn't fit in one base 36 digit" % value)
+    return _BASE36_DIGITS[value]
+
+
+def _measure_header(measure):
+    # 3 digits when they're enough, 5 otherwise. A bare 5-digit measure and type
+    # would read back as a 3-digit header with a lane and channel (see
+    # _NOTE_HEADER), but every header written here has a lane or a change kind
+    # after the type, so a 5-digit one is at least 7 characters long and can't be
+    # mistaken for a 3-digit one.
+    if measure < 1000:
+        return "%03d" % measure
+    return "%05d" % measure
+
+
+def _format_speed_definition(obj):
+    speeds = ", ".join("%s'%s:%s" % speed for speed in obj.speeds)
+    return '#TIL%s: "%s"' % (obj.identifier, speeds)
+
+
+def _format_attribute_definition(obj):
+    values = [
+        "%s:%s" % (name, value)
+        for name, value in (
+            ("rh", obj.roll_speed),
+            ("h", obj.height),
+            ("pr", obj.priority),
+        )
+        if value is not None
+    ]
+    return '#ATR%s: "%s"' % (obj.identifier, ", ".join(values))
+
+
+def _pack_lines(header, slots, ticks_per_measure):
+    """
+    Data lines for (tick, value, width) slots that share a header.
+
+    Each line uses the coarsest subdivision of the measure that still puts every
+    one of its ticks on a slot, found with the GCD of the ticks. Slots on a tick
+    that's already taken go to another line with the same header.
+    """
+    lines = []
+    while slots:
+        taken = {}
+        rest = []
+        for slot in slots:
+            if slot[0] in taken:
+                rest.append(slot)
             else:
-                # Standard 3-digit format
-                if len(header) > 3:
-                    note_type = header[3]
-                    if note_type == "0" and len(header) > 4:  # BPM or bar length change
-                        measure_value = int(measure) + context.base_measure
-                        change_type = header[4]
-                        if change_type == "2":
-                            # Bar length change. The data payload is an integer specifying the bar length in beats.
-                            obj = BarLength()
-                            obj.measure = measure_value
-                            obj.length = int(data)
-                            print("Applying bar length change")
-                            return [obj]
-                        if change_type == "8":
-                            # BPM change. The data payload is an in integer referencing the BPM definition to use.
-                            obj = BpmChange()
-                            obj.measure = measure_value
-                            obj.definition = context.bpm_definitions[data]
-                            print("Applying BPM change")
-                            return [obj]
-
-                # Every other note type requires parsing the data payload as a set of pairs of digits
-                # Remove whitespace from data
-                data = "".join(data.split())
-
-                # Handle potentially empty data
-                if not data:
-                    print("Warning: Empty data for note, skipping")
-                    return []
+                taken[slot[0]] = slot
+        step = reduce(gcd, taken, ticks_per_measure)
+        data = ["00"] * (ticks_per_measure // step)
+        for tick, value, width in taken.values():
+            data[tick // step] = _base36(value) + _base36(width)
+        lines.append("#%s:%s" % (header, "".join(data)))
+        slots = rest
+    return lines
 
-                tick_subdivision = context.ticks_per_measure // (len(data) // 2)
-                parsed_data = [
-                    (
-                        tick_subdivision * (i // 2),
-                        int(data[i], 36),
-                        int(data[i + 1], 36),
-                    )
-                    for i in range(0, len(data), 2)
-                    if i + 1 < len(data)
-                ]
-
-                if len(header) > 4 and (
-                    note_type == "1" or note_type == "5"
-                ):  # Tap or air note
-                    measure_value = int(measure) + context.base_measure
-                    lane = int(header[4], 36)  # Use base-36 for lanes
-                    objects = []
-                    for tick, tap_type, width in parsed_data:
-                        if tap_type == 0:
-                            # Skip 0 entries
-                            continue
-
-                        obj = ShortNote()
-                        obj.lane = lane
-                        obj.measure = measure_value
-                        obj.tick = tick
-                        if note_type == "1":
-                            obj.note_type = TapNoteType(tap_type)
-                        else:
-                            obj.note_type = AirNoteType(tap_type)
-                        obj.width = width
-                        obj.speed = context.active_speed
-                        obj.attribute = context.active_attribute
-                        objects.append(obj)
-
-                    print(f"Found {len(objects)} short notes")
-                    return objects
 
-                if len(header) > 5 and (
-                    note_type == "2" or note_type == "3" or note_type == "4"
-                ):  # Hold, slide, or air hold note
-                    measure_value = int(measure) + context.base_measure
-                    lane = int(header[4], 36)  # Use base-36 for lanes
-
-                    if len(header) <= 5:
-                        print(
-                            f"Warning: Long note header too short ({header}), skipping"
-                        )
-                        return []
-
-                    channel = header[5]
-
-                    objects = []
-                    for tick, long_type, width in parsed_data:
-                        if long_type == 0:
-                            # Skip 0 entries
-                            continue
-
-                        obj = LongNote()
-                        obj.note_kind = LongNoteKind(
-                            int(note_type)
-                        )  # Hold, slide, or air hold
-                        obj.note_type = LongNoteType(
-                            long_type
-                        )  # Start, tick, curve point, end, etc
-                        obj.lane = lane
-                        obj.measure = measure_value
-                        obj.tick = tick
-                        obj.width = width
-                        obj.speed = context.active_speed
-                        obj.attribute = context.active_attribute
-                        obj.channel = channel  # Set the channel for linking notes
-
-                        if not channel in context.channels.keys():
-                            context.channels[channel] = []
-
-                        # Add the object to its channel, and link it to the other objects in the same channel
-                        obj.linked = context.channels[channel]
-                        context.channels[channel].append(obj)
-
-                        # Sort the channel by time
-                        context.channels[channel].sort(
-                            key=lambda item: item.measure
-                            + item.tick / context.ticks_per_measure
-                        )
-
-                        objects.append(obj)
-                    print(f"Found {len(objects)} long notes")
-                    return objects
+def _note_lines(notes, ticks_per_measure):
+    """
+    Data lines for notes, grouped by measure, note type, lane and channel.
+    """
+    groups = defaultdict(list)
+    for note in notes:
+        (measure, tick) = divmod(
+            note.measure * ticks_per_measure + note.tick, ticks_per_measure
+        )
+        if isinstance(note, LongNote):
+            header = "%s%s%s" % (note.note_kind.value, _base36(note.lane), note.channel)
+        elif isinstance(note.note_type, AirNoteType):
+            header = "5%s" % _base36(note.lane)
+        else:
+            header = "1%s" % _base36(note.lane)
+        groups[(measure, header)].append((tick, note.note_type.value, note.width))
 
-    print(f"Skipped unsupported statement\n{sus_string}")
-    return []
+    lines = []
+    for (measure, header), slots in sorted(groups.items()):
+        header = _measure_header(measure) + header
+        lines += _pack_lines(header, slots, ticks_per_measure)
+    return lines
 
 
-def create_file(sus_objects):
+def create_file(sus_objects, ticks_per_measure=SUS_TICKS_PER_MEASURE):
     """
     Create a SUS file from a list of SUS objects.
 
+    Notes are written in the HISPEED and ATTRIBUTE regions of their speed and
+    attribute, after the definitions they refer to.
+
     Args:
         sus_objects: List of SUS objects
+        ticks_per_measure: Resolution of the note ticks
 
     Returns:
         String representation of the SUS file
@@ -506,16 +800,52 @@ def create_file(sus_objects):
     output.append('#SONGID "0"')
     output.append('#WAVE ""')
 
+    # Definition each (tag, identifier) refers to at this point of the file.
+    # Parsed charts only hold definitions through what uses them, so they are
+    # written just before their first use, and again if another definition took
+    # their identifier in between.
+    defined = {}
+
+    def define(tag, obj, line):
+        if defined.get((tag, obj.identifier)) is not obj:
+            defined[(tag, obj.identifier)] = obj
+            output.append(line)
+
+    # Notes of each (speed, attribute) region, in order of appearance
+    regions = {}
     for obj in sus_objects:
         if isinstance(obj, Request):
             output.append(f"#REQUEST {obj.content}")
+        elif isinstance(obj, WaveOffset):
+            output.append(f"#WAVEOFFSET {obj.offset}")
         elif isinstance(obj, BpmDefinition):
-            output.append(f"#BPM{obj.identifier}: {obj.tempo}")
+            define("BPM", obj, f"#BPM{obj.identifier}: {obj.tempo}")
         elif isinstance(obj, BarLength):
-            # TODO: This doesn't handle measure changes correctly yet
-            output.append(f"#{obj.measure:05d}02: {obj.length}")
+            output.append(f"#{_measure_header(obj.measure)}02: {obj.length}")
         elif isinstance(obj, BpmChange):
-            output.append(f"#{obj.measure:05d}08: {obj.definition.identifier}")
+            definition = obj.definition
+            line = f"#BPM{definition.identifier}: {definition.tempo}"
+            define("BPM", definition, line)
+            output.append(f"#{_measure_header(obj.measure)}08: {definition.identifier}")
+        elif isinstance(obj, (ShortNote, LongNote)):
+            regions.setdefault((obj.speed, obj.attribute), []).append(obj)
+
+    (active_speed, active_attribute) = (None, None)
+    for (speed, attribute), notes in regions.items():
+        if speed is not active_speed:
+            if speed is None:
+                output.append("#NOSPEED")
+            else:
+                define("TIL", speed, _format_speed_definition(speed))
+                output.append(f"#HISPEED {speed.identifier}")
+            active_speed = speed
+        if attribute is not active_attribute:
+            if attribute is None:
+                output.append("#NOATTRIBUTE")
+            else:
+                define("ATR", attribute, _format_attribute_definition(attribute))
+                output.append(f"#ATTRIBUTE {attribute.identifier}")
+            active_attribute = attribute
+        output += _note_lines(notes, ticks_per_measure)
 
-    # TODO: Implement proper note serialization
-    return "\n".join(output)
+    return "\n".join(output) + "\n"
@@ -0,0 +1,119 @@
+from bisect import bisect_right
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+DEFAULT_BPM = 120.0
+
+
+class TempoMap:
+    """
+    Converts chart positions to seconds and back.
+
+    The time at which each tempo starts is summed once when the map is built,
+    so a conversion is one bisect over the tempo changes and a multiplication.
+
+    Positions are absolute ticks of the chart's Timeline, or (measure, tick)
+    pairs that go through it. Seconds are relative to the audio: a positive
+    offset (#WAVEOFFSET) means the chart starts that many seconds before it.
+    """
+
+    def __init__(self, timeline, bpm_changes=(), offset=0.0):
+        """
+        Args:
+            timeline: Timeline of the chart
+            bpm_changes: (absolute tick, bpm) pairs, in any order. A tempo applies
+                from its tick until the next one, and the first one also applies
+                before it. Later pairs for the same tick win
+            offset: Seconds the chart starts before the audio
+        """
+        self.timeline = timeline
+        self.offset = offset
+
+        changes = {}
+        for tick, bpm in bpm_changes:
+            changes[tick] = bpm
+        if not changes:
+            changes[0] = DEFAULT_BPM
+        first = min(changes)
+        if first > 0:
+            # The first tempo also applies before it
+            changes[0] = changes.pop(first)
+
+        # Start tick, seconds per tick and start time (in chart seconds) of each tempo
+        ticks_per_beat = timeline.ticks_per_measure
+        self.ticks = []
+        self.tick_seconds = []
+        self.starts = []
+        start = 0.0
+        for tick in sorted(changes):
+            if self.ticks:
+                start += (tick - self.ticks[-1]) * self.tick_seconds[-1]
+            self.ticks.append(tick)
+            self.tick_seconds.append(60.0 / (changes[tick] * ticks_per_beat))
+            self.starts.append(start)
+
+    def bpm_at(self, absolute):
+        """
+        Tempo at an absolute tick.
+        """
+        i = bisect_right(self.ticks, absolute) - 1
+        return 60.0 / (self.tick_seconds[max(i, 0)] * self.timeline.ticks_per_measure)
+
+    def seconds_at(self, absolute):
+        """
+        Time of an absolute tick, in seconds.
+        """
+        i = max(bisect_right(self.ticks, absolute) - 1, 0)
+        return (
+            self.starts[i]
+            + (absolute - self.ticks[i]) * self.tick_seconds[i]
+            - self.offset
+        )
+
+    def seconds(self, measure, tick):
+        """
+        Time of a (measure, tick) position, in seconds.
+        """
+        return self.seconds_at(self.timeline.absolute(measure, tick))
+
+    def absolute_at(self, seconds):
+        """
+        Absolute tick at a time in seconds, as a float.
+        """
+        seconds += self.offset
+        i = max(bisect_right(self.starts, seconds) - 1, 0)
+        return self.ticks[i] + (seconds - self.starts[i]) / self.tick_seconds[i]
+
+    def position(self, seconds):
+        """
+        (measure, tick) position at a time in seconds, rounded to the nearest tick.
+        """
+        return self.timeline.position(round(self.absolute_at(seconds)))
+
+    def seconds_at_array(self, absolutes):
+        """
+        Times of a whole array of absolute ticks, in seconds.
+
+        Takes and returns NumPy arrays when NumPy is installed, lists otherwise.
+        """
+        if numpy is None:
+            return [self.seconds_at(absolute) for absolute in absolutes]
+
+        absolutes = numpy.asarray(absolutes, dtype="int64")
+        i = numpy.searchsorted(self.ticks, absolutes, side="right") - 1
+        i[i < 0] = 0
+        ticks = numpy.asarray(self.ticks, dtype="int64")[i]
+        tick_seconds = numpy.asarray(self.tick_seconds)[i]
+        starts = numpy.asarray(self.starts)[i]
+        return starts + (absolutes - ticks) * tick_seconds - self.offset
+
+    def seconds_array(self, measures, ticks):
+        """
+        Times of whole arrays of measures and ticks, in seconds.
+
+        Takes and returns NumPy arrays when NumPy is installed, lists otherwise.
+        """
+        return self.seconds_at_array(self.timeline.absolute_array(measures, ticks))
@@ -1,5 +1,8 @@
 from .sus import *
+from bisect import bisect_left
+from collections import defaultdict
 from sys import argv
+import io
 
 def output_shortnote(tapnote:ShortNote):
     short_note_chars = {
@@ -31,21 +34,68 @@ def output_shortnote(tapnote:ShortNote):
     else:
         return (retval, "")
 
-def print_note_group(group, buffer, measure_division, ticks_per_measure = SUS_TICKS_PER_MEASURE):
-    notes = []
-    group = list(group)
-    for item in group:
-        offset = 2 * (item.measure * measure_division + item.tick // (ticks_per_measure // measure_division))
-        notes.append((offset, item))
-
-    min_offset = min(p[0] for p in notes)
-    max_offset = max(p[0] for p in notes)
-
-    for offset in range(min_offset, max_offset + 1):
+class Canvas:
+    """
+    Grid of characters that one window of rows of the chart is drawn on.
+
+    Rows are lists of characters, allocated once and cleared for every window,
+    so drawing only changes the characters a note covers.
+    """
+
+    def __init__(self, width, height):
+        self.width = width
+        self.rows = [[" "] * width for i in range(height)]
+        self.first = 0 # Offset of the first row of the window
+
+    def clear(self, first):
+        self.first = first
+        blank = [" "] * self.width
+        for row in self.rows:
+            row[:] = blank
+
+    def draw(self, offset, update):
+        row = self.rows[offset - self.first]
+        for i, char in enumerate(update):
+            if char != " ":
+                row[i] = char
+
+    def write(self, fp, separator=""):
+        """
+        Write the rows, top (last) row first, each on its own line. Every line
+        but the first is preceded by a newline, and the first by `separator`.
+        """
+        fp.write(separator)
+        fp.write("\n".join("┃" + "".join(row) + "┃" for row in reversed(self.rows)))
+
+def note_group_rows(group, measure_division, ticks_per_measure = SUS_TICKS_PER_MEASURE):
+    """
+    Notes of a chain with their row offsets, and the offset after the last row
+    the chain is drawn on.
+    """
+    notes = list(group)
+    offsets = [2 * (item.measure * measure_division + item.tick // (ticks_per_measure // measure_division)) for item in notes]
+    stop = max(offsets) + 1
+    # Drawing stops at the first empty row after an END note
+    for i in range(1, len(notes)):
+        if offsets[i] > offsets[i - 1] + 1 and notes[i - 1].note_type == LongNoteType["END"]:
+            stop = offsets[i - 1] + 1
+            break
+    return (notes, offsets, stop)
+
+def print_note_group(rows, canvas, start, stop):
+    # A chain is in time order, so the offsets of its notes never go down and a
+    # single sweep over the rows finds the notes around each of them
+    (notes, offsets, end) = rows
+    start = max(start, min(offsets))
+    stop = min(stop, end)
+
+    i = bisect_left(offsets, start) # Index of the first note at or after the current row
+    for offset in range(start, stop):
+        while i < len(notes) and offsets[i] < offset:
+            i += 1
         update = ""
-        current = list(n for n in notes if n[0] == offset)
-        if len(current) != 0:
-            note = current[0][1]
+        if i < len(notes) and offsets[i] == offset:
+            note = notes[i]
             if note.note_kind == LongNoteKind["AIR_HOLD"]:
                 if note.width == 1:
                     update = "    " * note.lane + " [] "
@@ -56,55 +106,60 @@ def print_note_group(group, buffer, measure_division, ticks_per_measure = SUS_TI
                     update = "    " * note.lane + " " + "|" * 2 + " "
                 else:
                     update = "    " * note.lane + "|" + "-" * 3 + "-" * 4 * (note.width - 2) + "-" * 3 + "|"
-        else:
-            prev = list(n for n in notes if n[0] < offset)
-            nxt = list(n for n in notes if n[0] > offset)
-            if len(prev) != 0 and len(nxt) != 0:
-                prev = prev[-1]
-                nxt = nxt[0]
-                if prev[1].note_type == LongNoteType["END"]:
-                    break
-                lerp_amount = (offset - prev[0]) / (nxt[0] - prev[0])
-                lerped_lane = int(4 * (prev[1].lane + lerp_amount * (nxt[1].lane - prev[1].lane)))
-                lerped_width = int(4 * (prev[1].width + lerp_amount * (nxt[1].width - prev[1].width)))
-                if prev[1].note_kind == LongNoteKind["AIR_HOLD"]:
-                    print_position = lerped_lane + lerped_width // 2
-                    update = " " * (print_position - 1) + "/\\"
-                else:
-                    update = " " * lerped_lane + "|" + "." * (lerped_width - 2) + "|"
-        update_buffer(buffer, offset, update)
+        elif 0 < i < len(notes):
+            prev = (offsets[i - 1], notes[i - 1])
+            nxt = (offsets[i], notes[i])
+            lerp_amount = (offset - prev[0]) / (nxt[0] - prev[0])
+            lerped_lane = int(4 * (prev[1].lane + lerp_amount * (nxt[1].lane - prev[1].lane)))
+            lerped_width = int(4 * (prev[1].width + lerp_amount * (nxt[1].width - prev[1].width)))
+            if prev[1].note_kind == LongNoteKind["AIR_HOLD"]:
+                print_position = lerped_lane + lerped_width // 2
+                update = " " * (print_position - 1) + "/\\"
+            else:
+                update = " " * lerped_lane + "|" + "." * (lerped_width - 2) + "|"
+        if update:
+            canvas.draw(offset, update)
 
-def convert(data, measure_division):
+def write_text(fp, data, measure_division, ticks_per_measure = SUS_TICKS_PER_MEASURE):
+    """
+    Render SUS objects to text, writing one measure at a time to a text stream.
+
+    Measures are drawn on a canvas of a single measure, last measure first as
+    they are written, so memory doesn't grow with the length of the chart.
+    """
     short_notes = list(filter(lambda obj: isinstance(obj, ShortNote), data))
     long_notes = list(filter(lambda obj: isinstance(obj, LongNote), data))
-    long_note_groups = set(
-        tuple(i) for i in map(
-            lambda note: note.linked,
-            long_notes
-        )
-    )
+    # Each chain is shared by all of its notes, so collect each one once
+    long_note_groups = list({id(note.linked): note.linked for note in long_notes}.values())
 
     last_measure = max(map(lambda obj: obj.measure, short_notes + long_notes))
-    buffer = [" " * 64 for i in range((last_measure + 1) * measure_division * 2)]
+    rows_per_measure = measure_division * 2
 
+    # What to draw on each measure, in drawing order
+    measure_short_notes = defaultdict(list)
     for note in short_notes:
-        offset = note.measure * measure_division + note.tick // (SUS_TICKS_PER_MEASURE // measure_division)
-        update = output_shortnote(note)
-        update_buffer(buffer, offset * 2, update[0])
-        update_buffer(buffer, offset * 2 + 1, update[1])
-
+        offset = note.measure * measure_division + note.tick // (ticks_per_measure // measure_division)
+        measure_short_notes[offset * 2 // rows_per_measure].append((offset * 2, note))
+    measure_groups = defaultdict(list)
     for group in long_note_groups:
-        print_note_group(group, buffer, measure_division)
-
-    buffer.reverse()
-
-    return "┃" + "┃\n┃".join(buffer) + "┃"
+        rows = note_group_rows(group, measure_division, ticks_per_measure)
+        for measure in range(min(rows[1]) // rows_per_measure, (rows[2] - 1) // rows_per_measure + 1):
+            measure_groups[measure].append(rows)
+
+    canvas = Canvas(64, rows_per_measure)
+    for measure in range(last_measure, -1, -1):
+        start = measure * rows_per_measure
+        stop = start + rows_per_measure
+        canvas.clear(start)
+        for offset, note in measure_short_notes.pop(measure, ()):
+            update = output_shortnote(note)
+            canvas.draw(offset, update[0])
+            canvas.draw(offset + 1, update[1])
+        for rows in measure_groups.pop(measure, ()):
+            print_note_group(rows, canvas, start, stop)
+        canvas.write(fp, "" if measure == last_measure else "\n")
 
-def update_buffer(buffer, offset, update):
-    line = list(buffer[offset])
-
-    for i in range(len(update)):
-        if update[i] != " ":
-            line[i] = update[i]
-
-    buffer[offset] = "".join(line)
\ No newline at end of file
+def convert(data, measure_division):
+    output = io.StringIO()
+    write_text(output, data, measure_division)
+    return output.getvalue()
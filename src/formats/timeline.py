@@ -0,0 +1,154 @@
+from bisect import bisect_left, bisect_right
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+DEFAULT_BEATS = 4
+
+
+class Timeline:
+    """
+    Maps chart positions, given as (measure, tick), to absolute ticks and back.
+
+    Ticks within a measure are in the resolution of the chart format: a whole
+    measure is ticks_per_measure ticks, whatever its length. Absolute ticks
+    count ticks_per_measure per beat instead, so a measure of n beats spans
+    n * ticks_per_measure absolute ticks, and every position maps to an exact
+    integer that orders the same way as the position.
+
+    Bar lengths are kept as segments of measures with the same number of
+    beats, which lookups find with bisect. See sus.build_timeline() and
+    c2s.build_timeline() to build one for a parsed chart.
+    """
+
+    def __init__(self, ticks_per_measure, bar_lengths=(), default_beats=DEFAULT_BEATS):
+        """
+        Args:
+            ticks_per_measure: Ticks in a measure, in the chart format's resolution
+            bar_lengths: (measure, beats) pairs, in any order. A bar length applies
+                from its measure until the next one. Later pairs for the same
+                measure win
+            default_beats: Beats per measure before the first bar length
+        """
+        self.ticks_per_measure = ticks_per_measure
+
+        changes = {0: default_beats}
+        for measure, beats in bar_lengths:
+            changes[measure] = beats
+
+        # Start measure, beats per measure and start absolute tick of each segment
+        self.measures = []
+        self.beats = []
+        self.starts = []
+        start = 0
+        for measure in sorted(changes):
+            beats = changes[measure]
+            if self.beats:
+                if beats == self.beats[-1]:
+                    continue
+                measures = measure - self.measures[-1]
+                start += measures * ticks_per_measure * self.beats[-1]
+            self.measures.append(measure)
+            self.beats.append(beats)
+            self.starts.append(start)
+
+    def beats_at(self, measure):
+        """
+        Number of beats in the given measure.
+        """
+        return self.beats[bisect_right(self.measures, measure) - 1]
+
+    def absolute(self, measure, tick):
+        """
+        Absolute tick of a position.
+        """
+        if len(self.measures) == 1:
+            return (measure * self.ticks_per_measure + tick) * self.beats[0]
+        i = bisect_right(self.measures, measure) - 1
+        if i < 0:
+            i = 0
+        ticks = (measure - self.measures[i]) * self.ticks_per_measure + tick
+        return self.starts[i] + ticks * self.beats[i]
+
+    def position(self, absolute):
+        """
+        (measure, tick) position of an absolute tick.
+        """
+        i = bisect_right(self.starts, absolute) - 1
+        if i < 0:
+            i = 0
+        (measures, tick) = divmod(
+            absolute - self.starts[i], self.ticks_per_measure * self.beats[i]
+        )
+        return (self.measures[i] + measures, tick // self.beats[i])
+
+    def key(self, obj):
+        """
+        Absolute tick of an object with a measure and a tick, for use as a sort key.
+        """
+        return self.absolute(obj.measure, obj.tick)
+
+    def sort(self, objects):
+        """
+        Sort objects with a measure and a tick in place, in time order.
+        Objects at the same time keep their order.
+        """
+        if len(self.measures) == 1:
+            # Bar lengths don't change, so (measure, tick) alone orders the same way
+            ticks_per_measure = self.ticks_per_measure
+            objects.sort(key=lambda obj: obj.measure * ticks_per_measure + obj.tick)
+        else:
+            objects.sort(key=self.key)
+
+    def absolute_array(self, measures, ticks):
+        """
+        Absolute ticks of whole arrays of measures and ticks at once.
+
+        Takes and returns NumPy arrays when NumPy is installed, lists otherwise.
+        """
+        if numpy is None:
+            return [self.absolute(m, t) for m, t in zip(measures, ticks)]
+
+        measures = numpy.asarray(measures, dtype="int64")
+        ticks = numpy.asarray(ticks, dtype="int64")
+        if len(self.measures) == 1:
+            return (measures * self.ticks_per_measure + ticks) * self.beats[0]
+        i = numpy.searchsorted(self.measures, measures, side="right") - 1
+        i[i < 0] = 0
+        segment_measures = numpy.asarray(self.measures, dtype="int64")[i]
+        segment_beats = numpy.asarray(self.beats, dtype="int64")[i]
+        segment_starts = numpy.asarray(self.starts, dtype="int64")[i]
+        return (
+            segment_starts
+            + ((measures - segment_measures) * self.ticks_per_measure + ticks)
+            * segment_beats
+        )
+
+    def position_array(self, absolutes):
+        """
+        (measures, ticks) positions of a whole array of absolute ticks at once.
+
+        Takes NumPy arrays or any sequence, returns two lists.
+        """
+        if numpy is None:
+            positions = [self.position(absolute) for absolute in absolutes]
+            return ([m for m, _ in positions], [t for _, t in positions])
+
+        absolutes = numpy.asarray(absolutes, dtype="int64")
+        i = numpy.searchsorted(self.starts, absolutes, side="right") - 1
+        i[i < 0] = 0
+        segment_beats = numpy.asarray(self.beats, dtype="int64")[i]
+        (measures, ticks) = numpy.divmod(
+            absolutes - numpy.asarray(self.starts, dtype="int64")[i],
+            self.ticks_per_measure * segment_beats,
+        )
+        measures += numpy.asarray(self.measures, dtype="int64")[i]
+        return (measures.tolist(), (ticks // segment_beats).tolist())
+
+    def index(self, sorted_keys, measure, tick):
+        """
+        Index of the first of a sorted list of absolute ticks at or after a position.
+        """
+        return bisect_left(sorted_keys, self.absolute(measure, tick))
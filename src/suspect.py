@@ -1,12 +1,39 @@
-from sys import argv
+from sys import argv, stderr, stdin, stdout
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+import io
+import os
+import time
 import formats.convert as convert
 import formats.text_sus as text_sus
 import formats.sus as sus
 import formats.c2s as c2s
+from formats.cache import ConversionCache
+from formats.diagnostics import DiagnosticSink, PrintSink, Severity
 
 
 def help():
-    print("Usage: suspect.py [command]")
+    print("Usage: suspect.py [options] [command]")
+    print('Inputs can be "-" to read from stdin, and outputs "-" to write to stdout')
+    print("--quiet\n\tOnly print errors while parsing and converting")
+    print(
+        "--summary\n\tLike --quiet, then print how many of each message were reported"
+    )
+    print("--jobs=N\n\tWith batch, convert N files at a time (default: one per CPU)")
+    print("--retries=N\n\tWith batch, try failed files N more times (default: 1)")
+    print(
+        "--cache[=DIR]\n\tReuse the output of sustoc2s, c2stoc2s, c2stosus and batch for inputs that were converted before, kept in DIR (default: ~/.cache/suspect)"
+    )
+    print(
+        "--cache-size=MB\n\tDelete the least recently used outputs once the cache is bigger than MB (default: 512)"
+    )
+    print(
+        "--txt=N\n\tWith watch, also render charts to text with N lines per measure"
+    )
+    print("--interval=SECONDS\n\tWith watch, how often to check for changes (default: 0.5)")
+    print(
+        "--debounce=SECONDS\n\tWith watch, how long a file must stay unchanged before converting it (default: 0.3)"
+    )
     print(
         "sustotxt [input] [measure_div] [output]\n\tRenders a .sus file to unicode, using <measure_div> lines per measure"
     )
@@ -15,81 +42,444 @@ def help():
         "c2stoc2s [input] [output]\n\tTests the c2s parser / exporter by outputting a file equivalent to the input"
     )
     print("c2stosus [input] [output]\n\tConverts a c2s file to sus format")
+    print(
+        "watch [dir]\n\tConverts every .sus file under <dir> to c2s next to it, then again whenever it changes"
+    )
+    print(
+        "cache [clear]\n\tShows how many outputs the cache holds and its size, or deletes them"
+    )
+    print(
+        "batch [command] [input_dir] [pattern] [output_dir]\n\tRuns sustoc2s, c2stoc2s or c2stosus on every file matching <pattern> under <input_dir>, writing to <output_dir>"
+    )
     # print("sustoxml [input] [output] [id]\n\tExtracts metadata from .sus file into an XML file")
     # print("sus2sus [input] [output]\n\tTests the sus parser by outputting a file equivalent to the input")
     return 1
 
 
+def iter_sus(stream, context=None):
+    """
+    Parse SUS objects from a text stream (a file, stdin, ...) as its lines are read.
+
+    Long note channels are finalized when the stream runs out, before the generator
+    finishes. Until then, long notes may still be reordered or have their type fixed,
+    and aren't linked into chains yet. The converters read the generator to the end
+    before converting, so it can be passed to them directly.
+    """
+    if context is None:
+        context = sus.SusContext(diagnostics)
+    return sus.iter_parse(stream, context)
+
+
+def iter_c2s(stream):
+    """
+    Parse c2s objects from a text stream (a file, stdin, ...) as its lines are read.
+    """
+    return c2s.iter_parse(stream)
+
+
 def read_sus(filename):
-    data = []
+    if filename == "-":
+        return list(iter_sus(stdin))
     f = open(filename, "r")
-    lines = f.readlines()
+    data = list(iter_sus(f))
     f.close()
-    context = sus.SusContext()
-    for line in lines:
-        data += sus.from_string(line, context)
-
-    context.fix_channels()
-
     return data
 
 
 def read_c2s(filename):
-    data = []
+    if filename == "-":
+        return c2s.parse_c2s(stdin)
     f = open(filename, "r")
-    lines = f.readlines()
+    data = c2s.parse_c2s(f)
     f.close()
-    for line in lines:
-        data += c2s.from_string(line)
-
     return data
 
 
-def write_output(filename, output):
-    f = open(filename, "w")
-    f.write(output)
+def open_output(filename):
+    """
+    Open an output file for writing as text, or return stdout for "-".
+    """
+    if filename == "-":
+        return stdout
+    return open(filename, "w")
+
+
+def close_output(filename, f):
+    if f is stdout:
+        f.flush()
+        return
     f.close()
     print("Wrote %s" % filename)
 
 
-argc = len(argv)
-
-if argc == 1:
-    exit(help())
-
-if argv[1] == "sustotxt":
-    if argc != 5:
-        exit(help())
-    string = text_sus.convert(read_sus(argv[2]), int(argv[3]))
-    write_output(argv[4], string)
-    exit(0)
-
-if argv[1] == "c2stoc2s":
-    if argc != 4:
-        exit(help())
-    c2s_data = read_c2s(argv[2])
-    definitions = filter(lambda d: not isinstance(d, c2s.C2sNote), c2s_data)
-    notes = filter(lambda d: isinstance(d, c2s.C2sNote), c2s_data)
-    string = c2s.create_file(definitions, notes)
-    write_output(argv[3], string)
-    exit(0)
-
-if argv[1] == "sustoc2s":
-    if argc != 4:
-        exit(help())
-    sus_data = read_sus(argv[2])
-    (definitions, notes) = convert.sus_to_c2s(sus_data)
-    string = c2s.create_file(definitions, notes)
-    write_output(argv[3], string)
-    exit(0)
-
-if argv[1] == "c2stosus":
-    if argc != 4:
-        exit(help())
-    c2s_data = read_c2s(argv[2])
-    sus_data = convert.c2s_to_sus(c2s_data)
-    string = sus.create_file(sus_data)
-    write_output(argv[3], string)
-    exit(0)
-
-exit(help())
+diagnostics = PrintSink()
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "suspect")
+
+# Output extension of each command batch can run
+BATCH_COMMANDS = {"sustoc2s": ".c2s", "c2stoc2s": ".c2s", "c2stosus": ".sus"}
+
+
+def option_value(options, name, default):
+    """
+    Value of a --name=value option, or default if it wasn't given.
+    """
+    prefix = "--%s=" % name
+    for option in options:
+        if option.startswith(prefix):
+            return option[len(prefix) :]
+    return default
+
+
+def open_cache(options):
+    """
+    The ConversionCache selected by the --cache and --cache-size options, or None.
+    """
+    directory = option_value(options, "cache", None)
+    if directory is None:
+        if "--cache" not in options:
+            return None
+        directory = DEFAULT_CACHE_DIR
+    max_size = option_value(options, "cache-size", None)
+    # This module picks and drives the converters, so it's part of their version
+    sources = [os.path.abspath(__file__)]
+    if max_size is None:
+        return ConversionCache(directory, sources=sources)
+    return ConversionCache(directory, int(max_size) * 1024 * 1024, sources)
+
+
+# Options that only change how files are found, run or cached, not their output
+UNKEYED_OPTIONS = ("cache", "cache-size", "jobs", "retries")
+
+
+def cache_options(options):
+    """
+    The options a cached output depends on, normalized so that their order and
+    repeats don't change the cache key.
+    """
+    return sorted(
+        set(
+            option
+            for option in options
+            if option[2:].partition("=")[0] not in UNKEYED_OPTIONS
+        )
+    )
+
+
+def convert_input(command, filename, output, sink, cache=None, options=()):
+    """
+    Run a conversion command on an input file ("-" for stdin), writing the result
+    to a text stream.
+
+    With a cache, the output is looked up by the hash of the input and of the
+    options first, and stored there after converting if it wasn't found.
+
+    Returns:
+        Number of notes converted, or None when the output came from the cache
+    """
+    if filename == "-":
+        f = stdin
+        data = stdin.buffer.read() if cache is not None else None
+    elif cache is not None:
+        f = open(filename, "rb")
+        data = f.read()
+        f.close()
+    else:
+        f = open(filename, "r")
+
+    if cache is not None:
+        key = cache.key(data, command, *cache_options(options))
+        cached = cache.get(key)
+        if cached is not None:
+            output.write(cached)
+            return None
+        # Decode the bytes the same way opening the file as text does
+        f = io.TextIOWrapper(io.BytesIO(data))
+        # Keep the output to store it once it's complete
+        target = io.StringIO()
+    else:
+        target = output
+
+    if command == "sustoc2s":
+        sus_data = list(sus.iter_parse(f, sus.SusContext(sink)))
+        (definitions, notes) = convert.sus_to_c2s(sus_data, diagnostics=sink)
+        c2s.write_c2s(target, definitions, notes)
+    elif command == "c2stoc2s":
+        c2s_data = c2s.parse_c2s(f)
+        definitions = [d for d in c2s_data if not isinstance(d, c2s.C2sNote)]
+        notes = [d for d in c2s_data if isinstance(d, c2s.C2sNote)]
+        c2s.write_c2s(target, definitions, notes)
+    else:
+        sus_data = convert.c2s_to_sus(c2s.parse_c2s(f), diagnostics=sink)
+        notes = [d for d in sus_data if isinstance(d, (sus.ShortNote, sus.LongNote))]
+        target.write(sus.create_file(sus_data))
+    if f is not stdin:
+        f.close()
+
+    if cache is not None:
+        text = target.getvalue()
+        cache.put(key, text)
+        output.write(text)
+    return len(notes)
+
+
+def convert_file(command, input_filename, output_filename, options=()):
+    """
+    Run a conversion command on one file, for batch. Runs in a worker process,
+    with its own parser state and a diagnostics sink that only counts reports.
+
+    Returns:
+        (number of notes converted or None if cached, diagnostic counts) tuple
+    """
+    sink = DiagnosticSink(Severity.ERROR)
+    os.makedirs(os.path.dirname(output_filename) or ".", exist_ok=True)
+    f = open(output_filename, "w")
+    try:
+        notes = convert_input(
+            command, input_filename, f, sink, open_cache(options), options
+        )
+    except Exception:
+        # Don't leave half a file behind
+        f.close()
+        os.remove(output_filename)
+        raise
+    f.close()
+    return (notes, sink.counts)
+
+
+def batch(command, input_dir, pattern, output_dir, jobs=None, retries=1, options=()):
+    """
+    Convert every file matching a glob pattern under a directory, in a process pool.
+
+    Files that fail are tried again up to `retries` times, then skipped.
+
+    Returns:
+        Number of files that were skipped
+    """
+    inputs = sorted(path for path in Path(input_dir).rglob(pattern) if path.is_file())
+    outputs = {
+        path: str(
+            Path(output_dir, path.relative_to(input_dir)).with_suffix(
+                BATCH_COMMANDS[command]
+            )
+        )
+        for path in inputs
+    }
+    attempts = dict.fromkeys(inputs, 0)
+    (done, cached, failed, notes) = (0, 0, 0, 0)
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+
+        def submit(path):
+            attempts[path] += 1
+            return executor.submit(
+                convert_file, command, str(path), outputs[path], options
+            )
+
+        pending = {submit(path): path for path in inputs}
+        while pending:
+            future = next(as_completed(pending))
+            path = pending.pop(future)
+            try:
+                (count, counts) = future.result()
+            except Exception as e:
+                if attempts[path] <= retries:
+                    print("Retrying %s (%s)" % (path, e))
+                    pending[submit(path)] = path
+                    continue
+                failed += 1
+                print("[%d/%d] Skipped %s (%s)" % (done + failed, len(inputs), path, e))
+                continue
+            done += 1
+            if count is None:
+                cached += 1
+            else:
+                notes += count
+            diagnostics.counts.update(counts)
+            if "--quiet" not in options and "--summary" not in options:
+                print("[%d/%d] Wrote %s" % (done + failed, len(inputs), outputs[path]))
+
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    print(
+        "Converted %d files (%d from the cache, %d skipped) and %d notes in %.2f s"
+        % (done, cached, failed, notes, elapsed)
+    )
+    print("%.1f files/s, %.0f notes/s" % (done / elapsed, notes / elapsed))
+    return failed
+
+
+def scan(directory, pattern="*.sus"):
+    """
+    (mtime, size) of every file matching a glob pattern under a directory.
+    """
+    signatures = {}
+    for path in Path(directory).rglob(pattern):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue  # Deleted since it was listed
+        signatures[path] = (stat.st_mtime_ns, stat.st_size)
+    return signatures
+
+
+def convert_chart(path, measure_div=None):
+    """
+    Write the c2s file of a chart next to it, and its text rendering if measure_div
+    is given. The chart is only parsed once for both.
+    """
+    sus_data = read_sus(str(path))
+    (definitions, notes) = convert.sus_to_c2s(sus_data, diagnostics=diagnostics)
+    output = str(path.with_suffix(".c2s"))
+    f = open_output(output)
+    c2s.write_c2s(f, definitions, notes)
+    close_output(output, f)
+    if measure_div is not None:
+        output = str(path.with_suffix(".txt"))
+        f = open_output(output)
+        text_sus.write_text(f, sus_data, measure_div)
+        close_output(output, f)
+
+
+def watch(directory, measure_div=None, interval=0.5, debounce=0.3):
+    """
+    Keep the outputs of the charts under a directory up to date until interrupted.
+
+    Files are polled for changes to their mtime or size every `interval` seconds.
+    A changed file is converted once it has stayed the same for `debounce`
+    seconds, so a burst of saves from an editor only converts it once. Charts
+    whose c2s file is missing or older are converted when watching starts.
+    """
+    # Signature of each chart when it was last converted
+    converted = {}
+    for path, signature in scan(directory).items():
+        output = path.with_suffix(".c2s")
+        if output.exists() and output.stat().st_mtime_ns >= signature[0]:
+            converted[path] = signature
+    # Signature of each changed chart, and when it was first seen
+    changed = {}
+
+    print("Watching %s (Ctrl+C to stop)" % directory)
+    try:
+        while True:
+            now = time.monotonic()
+            signatures = scan(directory)
+            for path in list(converted):
+                if path not in signatures:
+                    del converted[path]
+            for path, signature in signatures.items():
+                if converted.get(path) == signature:
+                    changed.pop(path, None)
+                elif path not in changed or changed[path][0] != signature:
+                    changed[path] = (signature, now)
+
+            for path, (signature, seen) in list(changed.items()):
+                if now - seen < debounce:
+                    continue
+                del changed[path]
+                # Even if it fails, wait for the next change before trying again
+                converted[path] = signature
+                try:
+                    convert_chart(path, measure_div)
+                except Exception as e:
+                    print("Failed to convert %s (%s)" % (path, e))
+
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
+
+def main(argv):
+    global diagnostics
+
+    options = [arg for arg in argv[1:] if arg.startswith("--")]
+    argv = [arg for arg in argv if not arg.startswith("--")]
+    argc = len(argv)
+
+    # Messages go to stderr when the output is written to stdout
+    log = stderr if argc > 2 and argv[-1] == "-" else stdout
+    if "--quiet" in options or "--summary" in options:
+        diagnostics = PrintSink(Severity.ERROR, log)
+    elif log is not stdout:
+        diagnostics = PrintSink(file=log)
+
+    def finish():
+        if "--summary" in options:
+            print(diagnostics.summary(), file=log)
+        return 0
+
+    if argc == 1:
+        return help()
+
+    if argv[1] == "sustotxt":
+        if argc != 5:
+            return help()
+        sus_data = read_sus(argv[2])
+        f = open_output(argv[4])
+        text_sus.write_text(f, sus_data, int(argv[3]))
+        close_output(argv[4], f)
+        return finish()
+
+    if argv[1] in BATCH_COMMANDS:
+        if argc != 4:
+            return help()
+        cache = open_cache(options)
+        f = open_output(argv[3])
+        convert_input(argv[1], argv[2], f, diagnostics, cache, options)
+        close_output(argv[3], f)
+        if cache is not None:
+            cache.evict()
+        return finish()
+
+    if argv[1] == "batch":
+        if argc != 6 or argv[2] not in BATCH_COMMANDS:
+            return help()
+        jobs = option_value(options, "jobs", None)
+        failed = batch(
+            argv[2],
+            argv[3],
+            argv[4],
+            argv[5],
+            jobs=int(jobs) if jobs is not None else None,
+            retries=int(option_value(options, "retries", 1)),
+            options=options,
+        )
+        cache = open_cache(options)
+        if cache is not None:
+            cache.evict()
+        finish()
+        return 1 if failed else 0
+
+    if argv[1] == "watch":
+        if argc != 3:
+            return help()
+        measure_div = option_value(options, "txt", None)
+        watch(
+            argv[2],
+            measure_div=int(measure_div) if measure_div is not None else None,
+            interval=float(option_value(options, "interval", 0.5)),
+            debounce=float(option_value(options, "debounce", 0.3)),
+        )
+        return finish()
+
+    if argv[1] == "cache":
+        cache = open_cache(options + ["--cache"])
+        if argc == 3 and argv[2] == "clear":
+            print("Deleted %d entries from %s" % (cache.clear(), cache.directory))
+            return 0
+        if argc != 2:
+            return help()
+        entries = cache.entries()
+        print("Cache directory: %s" % cache.directory)
+        print("Entries: %d" % len(entries))
+        print(
+            "Size: %d KiB of %d KiB"
+            % (sum(size for (_, size, _) in entries) // 1024, cache.max_size // 1024)
+        )
+        return 0
+
+    return help()
+
+
+if __name__ == "__main__":
+    exit(main(argv))